@@ -0,0 +1,113 @@
+# bench_pc_server.py
+# Measures ROM transfer throughput and sender CPU cost for the pc_server download path.
+#
+# Usage: python bench_pc_server.py [--size-mb 512] [--runs 3] [--file path/to/rom]
+#
+# Each mode streams the same file over a local TCP connection to a draining reader:
+#   legacy    - the original 4096-byte read()/sendall() loop
+#   buffered  - the fallback path used when sendfile is unavailable
+#   sendfile  - the zero-copy path used by default
+
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from pc_server import stream_file, _send_buffered
+
+def _legacy_send(conn, f, offset, count):
+    f.seek(offset)
+    sent = 0
+    while chunk := f.read(4096):
+        conn.sendall(chunk)
+        sent += len(chunk)
+    return sent
+
+MODES = {
+    'legacy': _legacy_send,
+    'buffered': _send_buffered,
+    'sendfile': lambda conn, f, offset, count: stream_file(conn, f, offset, count, use_sendfile=True),
+}
+
+def _drain(sock, total, done):
+    received = 0
+    buffer = bytearray(1024 * 1024)
+    while received < total:
+        n = sock.recv_into(buffer)
+        if not n:
+            break
+        received += n
+    done['received'] = received
+
+def run_once(path, mode):
+    """Streams the file once using `mode` and returns (seconds, sender_cpu_seconds, bytes)."""
+    size = os.path.getsize(path)
+    listener = socket.create_server(('127.0.0.1', 0))
+    client = socket.create_connection(listener.getsockname())
+    server_side, _ = listener.accept()
+    listener.close()
+
+    done = {}
+    reader = threading.Thread(target=_drain, args=(client, size, done))
+    reader.start()
+
+    # thread_time only counts the sending thread, so the reader does not skew the CPU figure
+    with open(path, 'rb') as f:
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        MODES[mode](server_side, f, 0, size)
+        server_side.shutdown(socket.SHUT_WR)
+        reader.join()
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+
+    server_side.close()
+    client.close()
+    return wall, cpu, done.get('received', 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pc_server ROM transfer paths.")
+    parser.add_argument('--size-mb', type=int, default=512, help="Size of the generated test file (ignored with --file).")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per mode; the best run is reported.")
+    parser.add_argument('--file', help="Benchmark an existing ROM instead of a generated file.")
+    parser.add_argument('--modes', default=','.join(MODES), help="Comma-separated modes to run.")
+    args = parser.parse_args()
+
+    temp_path = None
+    path = args.file
+    if not path:
+        fd, temp_path = tempfile.mkstemp(suffix='.bin')
+        with os.fdopen(fd, 'wb') as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.size_mb):
+                f.write(block)
+        path = temp_path
+
+    try:
+        size = os.path.getsize(path)
+        print(f"File: {path} ({size / (1024 * 1024):.1f} MB), best of {args.runs} runs")
+        print(f"{'mode':<10} {'MB/s':>10} {'CPU s':>8} {'CPU ms/GB':>10}")
+        for mode in args.modes.split(','):
+            mode = mode.strip()
+            if mode == 'sendfile' and not hasattr(os, 'sendfile'):
+                print(f"{mode:<10} {'n/a (os.sendfile unavailable)':>30}")
+                continue
+            best = None
+            for _ in range(args.runs):
+                wall, cpu, received = run_once(path, mode)
+                if received != size:
+                    raise RuntimeError(f"{mode}: received {received} of {size} bytes")
+                if best is None or wall < best[0]:
+                    best = (wall, cpu)
+            wall, cpu = best
+            mb_per_s = size / (1024 * 1024) / wall
+            cpu_per_gb = cpu * 1000 / (size / (1024 ** 3))
+            print(f"{mode:<10} {mb_per_s:>10.1f} {cpu:>8.3f} {cpu_per_gb:>10.1f}")
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# blueprints/assets.py - Fingerprinted, long-cached static assets (emulator cores, nostalgist.js)
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import Blueprint, current_app, request, send_file, url_for, abort
+from werkzeug.security import safe_join
+
+assets_bp = Blueprint('assets', __name__)
+
+# Precompressed variants written by precompress_static.py, in order of preference
+PRECOMPRESSED_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+mimetypes.add_type('application/wasm', '.wasm')
+mimetypes.add_type('text/javascript', '.js')
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+def asset_fingerprint(path):
+    """Short content hash of a static file, remembered until its size or mtime changes."""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _fingerprints_lock:
+        if key in _fingerprints:
+            return _fingerprints[key]
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            sha.update(chunk)
+    fingerprint = sha.hexdigest()[:16]
+    with _fingerprints_lock:
+        _fingerprints[key] = fingerprint
+    return fingerprint
+
+def asset_url(filename):
+    """
+    URL for a file under static/ that embeds its content hash, so it can be cached forever.
+    Falls back to the plain static URL when the file does not exist.
+    """
+    path = safe_join(current_app.static_folder, filename)
+    if not path or not os.path.isfile(path):
+        return url_for('static', filename=filename)
+    return url_for('assets.fingerprinted_asset', fingerprint=asset_fingerprint(path), filename=filename)
+
+def core_asset_urls(core_name):
+    """Fingerprinted URLs of a libretro core's loader script and wasm binary."""
+    return {
+        'js': asset_url(f'js/cores/{core_name}_libretro.js'),
+        'wasm': asset_url(f'js/cores/{core_name}_libretro.wasm'),
+    }
+
+def _precompressed_variant(path):
+    """Returns (variant_path, encoding) for the best up-to-date precompressed copy the client accepts."""
+    source_mtime = os.stat(path).st_mtime_ns
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        if encoding not in request.accept_encodings:
+            continue
+        variant = path + suffix
+        try:
+            if os.stat(variant).st_mtime_ns >= source_mtime:
+                return variant, encoding
+        except OSError:
+            continue
+    return path, None
+
+@assets_bp.route('/assets/<string:fingerprint>/<path:filename>')
+def fingerprinted_asset(fingerprint, filename):
+    """
+    Serves a static file by fingerprinted URL. When the fingerprint matches the current
+    content the response is immutable for a year; a stale fingerprint (old page, new file)
+    still gets the current file, but only with a revalidation header.
+    """
+    path = safe_join(current_app.static_folder, filename)
+    if not path or not os.path.isfile(path):
+        abort(404)
+
+    send_path, encoding = _precompressed_variant(path)
+    response = send_file(send_path, mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                         conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+
+    if fingerprint == asset_fingerprint(path):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@assets_bp.route('/sw.js')
+def service_worker():
+    """
+    The emulator service worker (static/js/sw.js), served from the site root so its scope
+    covers /roms/web and /assets. Never cached by HTTP, so updates reach browsers promptly.
+    """
+    response = send_file(os.path.join(current_app.static_folder, 'js', 'sw.js'), mimetype='text/javascript')
+    response.cache_control.no_cache = True
+    response.cache_control.max_age = 0
+    return response
@@ -1,38 +1,32 @@
 import json
 import base64
+import hashlib
 import os
-import sqlite3
+import threading
+import zipfile
 from flask import Blueprint, render_template, abort, url_for, current_app, flash, redirect
 from pathlib import Path
+from scanner.core import get_rom_index_entry, rom_index_is_current, ROM_INDEX_COLUMNS
+from utils import get_game_record, invalidate_game_record
+from blueprints.assets import core_asset_urls
+import db
 
 emulation_bp = Blueprint('emulation', __name__)
 
 def get_db_connection():
-    conn = sqlite3.connect(current_app.config['DATABASE'])
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.get_connection(current_app.config['DATABASE'])
 
 @emulation_bp.route('/play_web_emulator/<int:game_id>')
 def play_web_emulator(game_id):
-    conn = get_db_connection()
-    game = conn.execute('''
-        SELECT 
-            g.id, g.title, g.filepath, g.original_filename, g.system,
-            s.emulator_core, s.aspect_ratio
-        FROM games g
-        JOIN systems s ON g.system = s.name
-        WHERE g.id = ?
-    ''', (game_id,)).fetchone()
-    conn.close()
-
-    if not game:
+    game = get_game_record(game_id)
+    if not game or game['system_id'] is None:
         abort(404)
 
-    # Check if the game is web playable and get the correct filename
-    game_obj, actual_file_to_serve, directory_to_serve_from, filename_to_serve, original_filename, is_web_playable = _get_rom_paths_for_serving(game_id)
+    # Check if the game is web playable and get the correct filename (reuses the record above)
+    game_obj, actual_file_to_serve, directory_to_serve_from, filename_to_serve, original_filename, is_web_playable, rom_member = _get_rom_paths_for_serving(game_id)
 
     if not is_web_playable or not filename_to_serve:
-        flash(f"Web emulation not available for this game. Ensure it's an unzipped, supported ROM file.", 'error')
+        flash(f"Web emulation not available for this game. Ensure it's a supported ROM file or a ZIP containing one.", 'error')
         return redirect(url_for('library.game_detail', game_id=game_id))
 
     # Generate the rom_url using the dedicated 'web_rom_file' endpoint
@@ -44,6 +38,8 @@ def play_web_emulator(game_id):
         'system': game['system'],
         'rom_url': rom_url,
         'emulator_core': game['emulator_core'],
+        'core_urls': core_asset_urls(game['emulator_core']) if game['emulator_core'] else None,
+        'save_state_url': url_for('saves.get_save', game_id=game_id, slot='state-1'),
         'emulator_aspect_ratio': game['aspect_ratio']
     }
 
@@ -61,80 +57,40 @@ def launch_game(game_id):
 def _get_rom_paths_for_serving(game_id):
     """
     Enhanced ROM path detection for better web emulator support.
-    Returns: (game_obj, actual_file_to_serve, directory_to_serve_from, filename_to_serve, original_filename, is_web_playable)
+    The resolved file comes from the ROM index stored on the (cached) game record; it is
+    only re-resolved (directory walk included) when the game's files changed on disk.
+    For zipped games actual_file_to_serve is the archive and rom_member the ROM inside it.
+    Returns: (game_obj, actual_file_to_serve, directory_to_serve_from, filename_to_serve, original_filename, is_web_playable, rom_member)
     """
-    conn = get_db_connection()
-    game = conn.execute('SELECT * FROM games WHERE id = ?', (game_id,)).fetchone()
-    conn.close()
-
+    game = get_game_record(game_id)
     if not game:
-        return None, None, None, None, None, False
+        return None, None, None, None, None, False, None
+    if rom_index_is_current(game):
+        rom_entry = {col: game[col] for col, _ in ROM_INDEX_COLUMNS}
+    else:
+        conn = get_db_connection()
+        try:
+            rom_entry = get_rom_index_entry(conn, game)
+        except Exception as e:
+            current_app.logger.error(f"Error processing ROM path for game {game_id}: {e}")
+            return game, None, None, None, game['original_filename'], False, None
+        finally:
+            conn.close()
+        invalidate_game_record(game_id)
 
-    filepath = game['filepath']
     original_filename = game['original_filename']
-    actual_file_to_serve = None
-    is_web_playable = False
-    filename_to_serve = None
-
-    # Define supported ROM extensions for web emulation
-    web_supported_extensions = {
-        '.nes', '.sfc', '.smc', '.gb', '.gbc', '.gba', 
-        '.gen', '.md', '.sms', '.gg', '.bin'
-    }
-
-    try:
-        if os.path.isdir(filepath):
-            # Search for ROM files in the directory
-            current_app.logger.info(f"Searching for ROM files in directory: {filepath}")
-            found_rom = None
-            
-            for root, _, files in os.walk(filepath):
-                for fname in files:
-                    file_ext = os.path.splitext(fname)[1].lower()
-                    if file_ext in web_supported_extensions:
-                        found_rom = os.path.join(root, fname)
-                        current_app.logger.info(f"Found supported ROM: {found_rom}")
-                        break
-                if found_rom:
-                    break
-            
-            if found_rom:
-                actual_file_to_serve = found_rom
-                filename_to_serve = os.path.basename(found_rom)
-                is_web_playable = True
-                current_app.logger.info(f"Directory scan successful - ROM: {filename_to_serve}")
-            else:
-                current_app.logger.warning(f"No supported ROM file found in directory {filepath}")
-                is_web_playable = False
-
-        elif os.path.isfile(filepath):
-            file_ext = os.path.splitext(filepath)[1].lower()
-            
-            if file_ext == '.zip':
-                current_app.logger.warning(f"Game ID {game_id}: ZIP files are not supported for web emulation")
-                is_web_playable = False
-                actual_file_to_serve = filepath
-                filename_to_serve = os.path.basename(filepath)
-            elif file_ext in web_supported_extensions:
-                actual_file_to_serve = filepath
-                filename_to_serve = os.path.basename(filepath)
-                is_web_playable = True
-                current_app.logger.info(f"Direct file is web playable: {filename_to_serve}")
-            else:
-                current_app.logger.warning(f"Unsupported file extension for web emulation: {file_ext}")
-                actual_file_to_serve = filepath
-                filename_to_serve = os.path.basename(filepath)
-                is_web_playable = False
-        else:
-            current_app.logger.error(f"Game ID {game_id}: Filepath {filepath} does not exist")
-            is_web_playable = False
+    actual_file_to_serve = rom_entry['web_rom_path']
+    filename_to_serve = rom_entry['web_rom_name']
+    is_web_playable = bool(rom_entry['is_web_playable'])
+    rom_member = rom_entry['web_rom_member']
 
-    except Exception as e:
-        current_app.logger.error(f"Error processing ROM path for game {game_id}: {e}")
-        is_web_playable = False
+    if not actual_file_to_serve:
+        current_app.logger.warning(f"Game ID {game_id}: no servable ROM found for {game['filepath']}")
+    elif not is_web_playable:
+        current_app.logger.warning(f"Game ID {game_id}: {filename_to_serve} is not supported for web emulation")
 
     if not actual_file_to_serve:
-        return game, None, None, None, original_filename, False
+        return game, None, None, None, original_filename, False, None
 
     # Security check: ensure file is within upload folder
     try:
@@ -143,13 +99,96 @@ def _get_rom_paths_for_serving(game_id):
         
         if upload_folder_path not in actual_file_path.parents and upload_folder_path != actual_file_path.parent:
             current_app.logger.error(f"Security violation: File outside upload folder: {actual_file_to_serve}")
-            return game, None, None, None, original_filename, False
+            return game, None, None, None, original_filename, False, None
     except Exception as e:
         current_app.logger.error(f"Error checking file security for {actual_file_to_serve}: {e}")
-        return game, None, None, None, original_filename, False
+        return game, None, None, None, original_filename, False, None
 
     directory_to_serve_from = os.path.dirname(actual_file_to_serve)
     
     current_app.logger.info(f"ROM path resolution complete - Game: {game_id}, Playable: {is_web_playable}, File: {filename_to_serve}")
     
-    return game, actual_file_to_serve, directory_to_serve_from, filename_to_serve, original_filename, is_web_playable
\ No newline at end of file
+    return game, actual_file_to_serve, directory_to_serve_from, filename_to_serve, original_filename, is_web_playable, rom_member
+
+# --- Decompressed ZIP member cache ---
+# Zipped ROMs are served from a decompressed copy in WEB_ROM_CACHE_FOLDER, keyed by the
+# archive's path, size and mtime. The first request streams the member straight out of
+# the archive while the copy is written, so it does not wait for a full extraction.
+_rom_cache_locks = {}
+_rom_cache_locks_guard = threading.Lock()
+ROM_CACHE_CHUNK_SIZE = 1024 * 1024
+
+def _rom_cache_lock(name):
+    with _rom_cache_locks_guard:
+        return _rom_cache_locks.setdefault(name, threading.Lock())
+
+def rom_member_cache_path(zip_path, member):
+    """Where the decompressed copy of `member` from `zip_path` lives in the cache."""
+    stat = os.stat(zip_path)
+    cache_key = hashlib.sha1(f"{zip_path}|{member}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+    return Path(current_app.config['WEB_ROM_CACHE_FOLDER']) / f"{cache_key}{Path(member).suffix.lower()}"
+
+def _prune_rom_cache(cache_dir, max_bytes, keep):
+    """Removes the least recently used cached members until the cache fits max_bytes."""
+    entries = []
+    total = 0
+    for path in cache_dir.iterdir():
+        if path.name.endswith('.tmp'):
+            continue
+        stat = path.stat()
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        path.unlink(missing_ok=True)
+        total -= size
+
+def get_cached_rom_member(zip_path, member):
+    """Returns the cached copy of a ZIP member if there is one, marking it recently used."""
+    cached_path = rom_member_cache_path(zip_path, member)
+    if cached_path.exists():
+        os.utime(cached_path)
+        return cached_path
+    return None
+
+def _iter_rom_member(zip_path, member, cached_path, max_bytes):
+    """Yields the member's bytes from the archive while writing them to the cache."""
+    temp_path = cached_path.with_name(f"{cached_path.name}.{threading.get_ident()}.tmp")
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zf, zf.open(member) as src, open(temp_path, 'wb') as dst:
+            while chunk := src.read(ROM_CACHE_CHUNK_SIZE):
+                dst.write(chunk)
+                yield chunk
+        with _rom_cache_lock(cached_path.name):
+            os.replace(temp_path, cached_path)
+            _prune_rom_cache(cached_path.parent, max_bytes, keep=cached_path)
+    finally:
+        # Client went away or the archive was unreadable; drop the partial copy
+        if temp_path.exists():
+            temp_path.unlink(missing_ok=True)
+
+def stream_rom_member(zip_path, member):
+    """
+    Returns (iterator, size) streaming a ZIP member to the client and into the cache.
+    The iterator is lazy, so nothing is decompressed if the response is never sent.
+    """
+    cached_path = rom_member_cache_path(zip_path, member)
+    cached_path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        size = zf.getinfo(member).file_size
+    return _iter_rom_member(zip_path, member, cached_path, current_app.config['WEB_ROM_CACHE_MAX_BYTES']), size
+
+def extract_rom_member(zip_path, member):
+    """Decompresses a ZIP member into the cache (if it is not there yet) and returns its path."""
+    cached_path = rom_member_cache_path(zip_path, member)
+    with _rom_cache_lock(cached_path.name):
+        if cached_path.exists():
+            os.utime(cached_path)
+            return cached_path
+    cached_path.parent.mkdir(parents=True, exist_ok=True)
+    for _ in _iter_rom_member(zip_path, member, cached_path, current_app.config['WEB_ROM_CACHE_MAX_BYTES']):
+        pass
+    return cached_path
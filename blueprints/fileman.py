@@ -1,13 +1,14 @@
 # blueprints/fileman.py - File Manager Blueprint
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
-from scanner.core import get_db_connection, download_and_set_cover_image, set_game_cover_image
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify
+from scanner.core import get_db_connection, download_and_set_cover_image, set_game_cover_image, update_rom_index, refresh_rom_index
 from blueprints.igdb import construct_igdb_image_url
+from utils import invalidate_game_record
+from blueprints.uploads import take_completed_upload, safe_system_folder, zip_extract_path, start_zip_extraction, start_batch_ingest
 from werkzeug.utils import secure_filename
 import os
 import tempfile
 import json
 import sqlite3
-import zipfile
 from pathlib import Path
 
 fileman_bp = Blueprint('fileman', __name__)
@@ -44,40 +45,43 @@ def upload_game():
                 flash('Title and system are required!', 'error')
                 return redirect(url_for('fileman.upload_game'))
             
-            # Handle file upload
-            if 'game_file' not in request.files:
-                flash('No game file provided!', 'error')
-                return redirect(url_for('fileman.upload_game'))
-            
-            game_file = request.files['game_file']
-            if game_file.filename == '':
-                flash('No game file selected!', 'error')
-                return redirect(url_for('fileman.upload_game'))
-            
-            # Secure the filename
-            original_filename = secure_filename(game_file.filename)
-            
-            # Create system directory
-            safe_system = "".join(c for c in system if c.isalnum() or c in (' ', '_')).strip().replace(' ', '_')
-            system_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], safe_system)
-            os.makedirs(system_dir, exist_ok=True)
-            
-            file_path = os.path.join(system_dir, original_filename)
-            game_file.save(file_path)
+            upload_id = request.form.get('upload_id', '').strip()
+            if upload_id:
+                # The file was already sent through the chunked upload API (blueprints/uploads.py)
+                uploaded_path = take_completed_upload(upload_id)
+                if not uploaded_path:
+                    flash('The uploaded file was not found or is incomplete. Please upload it again.', 'error')
+                    return redirect(url_for('fileman.upload_game'))
+                original_filename = os.path.basename(uploaded_path)
+                file_path = uploaded_path
+            else:
+                # Handle file upload
+                if 'game_file' not in request.files:
+                    flash('No game file provided!', 'error')
+                    return redirect(url_for('fileman.upload_game'))
+                
+                game_file = request.files['game_file']
+                if game_file.filename == '':
+                    flash('No game file selected!', 'error')
+                    return redirect(url_for('fileman.upload_game'))
+                
+                # Secure the filename
+                original_filename = secure_filename(game_file.filename)
+                
+                # Create system directory
+                system_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], safe_system_folder(system))
+                os.makedirs(system_dir, exist_ok=True)
+                
+                file_path = os.path.join(system_dir, original_filename)
+                game_file.save(file_path)
 
-            # Check if the uploaded file is a ZIP and extract it
+            # ZIPs are extracted in the background into a folder of the same name, which
+            # becomes the game's path; the game page shows the progress
+            zip_path = None
             if original_filename.lower().endswith('.zip'):
-                try:
-                    extract_path = os.path.splitext(file_path)[0] # Extract to a folder with the same name
-                    os.makedirs(extract_path, exist_ok=True)
-                    with zipfile.ZipFile(file_path, 'r') as zf:
-                        zf.extractall(extract_path)
-                    os.remove(file_path) # Delete the original zip file
-                    file_path = extract_path # The new filepath is the directory
-                except Exception as e:
-                    flash(f"Error extracting ZIP file: {e}", 'error')
-                    current_app.logger.error(f"Error extracting ZIP file: {e}")
-                    return redirect(url_for('fileman.upload_game'))
+                zip_path = file_path
+                file_path = zip_extract_path(zip_path)
+                os.makedirs(file_path, exist_ok=True)
             
             # Prepare metadata
             metadata = {
@@ -101,9 +105,12 @@ def upload_game():
                   metadata['description'], metadata['play_status'], None))
             
             game_id = cursor.lastrowid
+            update_rom_index(conn, game_id, file_path)
             conn.commit()
             conn.close()
             print(f"DEBUG: Newly inserted game ID is: {game_id}")
+            if zip_path:
+                start_zip_extraction(zip_path, game_id, job_id=upload_id or None)
             
             # Handle IGDB cover if provided
             igdb_image_id = request.form.get('igdb_cover_image_id', '').strip()
@@ -148,10 +155,34 @@ def upload_game():
 def batch_upload():
     """Handle batch file uploads (multiple games at once)."""
     if request.method == 'POST':
-        flash('Batch upload functionality coming soon!', 'info')
-        return redirect(url_for('fileman.upload_game'))
+        batch_id = start_batch_ingest(request.files.getlist('game_files'))
+        if request.accept_mimetypes.best == 'application/json':
+            if not batch_id:
+                return jsonify({'error': 'No files provided'}), 400
+            return jsonify({'batch_id': batch_id,
+                            'events_url': url_for('uploads.batch_events', batch_id=batch_id),
+                            'status_url': url_for('uploads.batch_status', batch_id=batch_id)}), 202
+        if not batch_id:
+            flash('No game files selected!', 'error')
+            return redirect(url_for('fileman.batch_upload'))
+        return redirect(url_for('fileman.batch_upload', batch=batch_id))
     
-    return render_template('batch_upload.html')
+    return render_template('batch_upload.html', batch_id=request.args.get('batch'))
+
+@fileman_bp.route('/rescan_rom_index', methods=['POST'])
+def rescan_rom_index():
+    """Re-checks every game's web-playable ROM, re-resolving those whose files changed."""
+    conn = get_db_connection()
+    try:
+        checked, updated = refresh_rom_index(conn, force=request.form.get('force') == '1')
+        invalidate_game_record()
+        flash(f'Checked {checked} games; {updated} web ROM entries refreshed.', 'success')
+    except Exception as e:
+        current_app.logger.error(f"Error rescanning ROM index: {e}")
+        flash(f'Error rescanning ROMs: {str(e)}', 'error')
+    finally:
+        conn.close()
+    return redirect(request.referrer or url_for('navigation.library'))
 
 @fileman_bp.route('/scan_directory', methods=['GET', 'POST'])
 def scan_directory():
@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify, flash, current_app
-from utils import get_setting
+from utils import get_setting, invalidate_game_record
 import json
 from datetime import datetime
 import requests
@@ -187,6 +187,7 @@ def igdb_set_cover():
         
         full_igdb_url = construct_igdb_image_url(image_id)
         new_path = download_and_set_cover_image(game_id, full_igdb_url, web_log)
+        invalidate_game_record(int(game_id))
         return jsonify({"success": True, "new_path": new_path})
         
     except Exception as e:
@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from scanner.core import get_db_connection, delete_games_from_db, update_game_metadata_in_db, download_and_set_cover_image, set_game_cover_image
 from blueprints.igdb import construct_igdb_image_url
+from utils import get_game_record, invalidate_game_record
+from blueprints.uploads import get_extraction_job_for_game
 import json
 import os
 import tempfile
@@ -10,25 +12,28 @@ library_bp = Blueprint('library', __name__)
 
 @library_bp.route('/<int:game_id>')
 def game_detail(game_id):
-    conn = get_db_connection()
-    game = conn.execute('SELECT * FROM games WHERE id = ?', (game_id,)).fetchone()
-    conn.close()
+    game = get_game_record(game_id)
     
     if game is None:
         flash('Game not found!', 'error')
         return redirect(url_for('navigation.library'))
     
     from blueprints.emulation import _get_rom_paths_for_serving
+    from blueprints.assets import core_asset_urls
     
     try:
-        game_obj, actual_file_to_serve, directory_to_serve_from, filename_to_serve, original_filename, is_web_playable = _get_rom_paths_for_serving(game_id)
+        game_obj, actual_file_to_serve, directory_to_serve_from, filename_to_serve, original_filename, is_web_playable, rom_member = _get_rom_paths_for_serving(game_id)
         
         web_emulator_url = None
         desktop_emulator_url = None
         download_url = None
+        core_urls = None
         
         if is_web_playable and filename_to_serve:
             web_emulator_url = url_for('emulation.play_web_emulator', game_id=game_id)
+            # Let the browser fetch the emulator core while the user is still on this page
+            if game['emulator_core']:
+                core_urls = core_asset_urls(game['emulator_core'])
         
         desktop_emulator_url = url_for('emulation.launch_game', game_id=game_id)
         
@@ -40,12 +45,17 @@ def game_detail(game_id):
         web_emulator_url = None
         desktop_emulator_url = None
         download_url = None
+        core_urls = None
     
+    extraction_job = get_extraction_job_for_game(game_id)
+
     return render_template('game_detail.html', 
                          game=game,
+                         extraction_job=extraction_job,
                          web_emulator_url=web_emulator_url,
                          desktop_emulator_url=desktop_emulator_url,
-                         download_url=download_url)
+                         download_url=download_url,
+                         core_urls=core_urls)
 
 @library_bp.route('/<int:game_id>/edit', methods=['GET', 'POST'])
 def edit_game(game_id):
@@ -115,6 +125,7 @@ def edit_game(game_id):
                 flash('Cover image cleared.', 'info')
             
             update_game_metadata_in_db(game_id, changes)
+            invalidate_game_record(game_id)
             flash('Game updated successfully!', 'success')
             return redirect(url_for('library.game_detail', game_id=game_id))
             
@@ -137,6 +148,7 @@ def delete_game(game_id):
 
     try:
         delete_games_from_db([game_id], web_log)
+        invalidate_game_record(game_id)
         flash('Game deleted successfully!', 'success')
     except Exception as e:
         current_app.logger.error(f"Error deleting game {game_id}: {e}")
@@ -1,9 +1,12 @@
 # blueprints/navigation.py - Navigation and routing only
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from scanner.core import get_all_games_from_db, get_db_connection
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from scanner.core import get_games_page, get_facet_counts, search_games, get_db_connection
 
 navigation_bp = Blueprint('navigation', __name__)
 
+# Most results a library search returns (the page, or the JSON endpoint)
+LIBRARY_SEARCH_LIMIT = 200
+
 @navigation_bp.route('/')
 def index():
     """Renders the main homepage (index.html)."""
@@ -24,18 +27,106 @@ def index():
 
     return render_template('index.html', systems=systems_data)
 
+# Library filters taken from the query string: URL parameter -> facets.FACET_FIELDS name
+LIBRARY_FILTER_ARGS = {'genre': 'genre', 'developer': 'developer', 'publisher': 'publisher', 'year': 'release_year'}
+
+def _library_filters():
+    """Returns ({facet field: value}, {url parameter: value}) for the filters in the request."""
+    filters, filter_args = {}, {}
+    for arg, field in LIBRARY_FILTER_ARGS.items():
+        value = request.args.get(arg, '').strip()
+        if arg == 'year':
+            value = request.args.get(arg, type=int)
+        if value:
+            filters[field] = value
+            filter_args[arg] = value
+    return filters, filter_args
+
+def _facet_sidebar(counts, system_name, web_playable_only, filter_args):
+    """Adds a toggle URL and a selected flag to every facet value for the library sidebar."""
+    playable = 1 if web_playable_only else None
+    fields = {field: arg for arg, field in LIBRARY_FILTER_ARGS.items()}
+    sidebar = {}
+    for field, values in counts.items():
+        for item in values:
+            if field == 'system':
+                item['selected'] = item['value'] == system_name
+                target_system = None if item['selected'] else item['value']
+                item['url'] = url_for('navigation.library', system_name=target_system, playable=playable, **filter_args)
+            else:
+                arg = fields[field]
+                item['selected'] = str(filter_args.get(arg)).lower() == str(item['value']).lower()
+                args = {k: v for k, v in filter_args.items() if k != arg}
+                if not item['selected']:
+                    args[arg] = item['value']
+                item['url'] = url_for('navigation.library', system_name=system_name, playable=playable, **args)
+        sidebar[field] = values
+    return sidebar
+
 @navigation_bp.route('/library')
 @navigation_bp.route('/library/<string:system_name>')
 def library(system_name=None):
-    """Renders the game library page, optionally filtered by system."""
-    if system_name:
-        games = get_all_games_from_db(system_name=system_name)
-        title = f"Games on {system_name}"
-    else:
-        games = get_all_games_from_db()
-        title = "My Game Library"
-        
-    return render_template('library.html', games=games, current_display_title=title, current_system_name=system_name)
+    """
+    Renders one page of the game library, optionally filtered by system, web playability,
+    genre, developer, publisher and year, with a sidebar of per-value counts for each filter.
+    Pages continue from the last card shown (?after_title=...&after_id=...) rather than an offset.
+    """
+    web_playable_only = request.args.get('playable') == '1'
+    search_query = request.args.get('q', '').strip()
+    title = f"Games on {system_name}" if system_name else "My Game Library"
+    if search_query:
+        games = search_games(search_query, system_name=system_name, web_playable_only=web_playable_only,
+                             limit=LIBRARY_SEARCH_LIMIT)
+        return render_template('library.html', games=games, current_display_title=title,
+                               current_system_name=system_name, web_playable_only=web_playable_only,
+                               search_query=search_query)
+
+    filters, filter_args = _library_filters()
+    after_id = request.args.get('after_id', type=int)
+    after = (request.args.get('after_title', ''), after_id) if after_id is not None else None
+    games, next_key = get_games_page(system_name=system_name, web_playable_only=web_playable_only, after=after,
+                                     filters=filters)
+    facet_counts = get_facet_counts(system_name=system_name, web_playable_only=web_playable_only, filters=filters)
+    sidebar = _facet_sidebar(facet_counts, system_name, web_playable_only, filter_args)
+
+    playable = 1 if web_playable_only else None
+    next_url = None
+    if next_key:
+        next_url = url_for('navigation.library', system_name=system_name, playable=playable,
+                           after_title=next_key[0], after_id=next_key[1], **filter_args)
+    first_url = None
+    if after:
+        first_url = url_for('navigation.library', system_name=system_name, playable=playable, **filter_args)
+
+    return render_template('library.html', games=games, current_display_title=title, current_system_name=system_name,
+                           web_playable_only=web_playable_only, next_page_url=next_url, first_page_url=first_url,
+                           facets=sidebar, filter_args=filter_args)
+
+@navigation_bp.route('/library/facets')
+def library_facets():
+    """
+    JSON game counts per system, genre, developer, publisher and release year, most common
+    first: ?[system=...][&playable=1][&genre=...][&developer=...][&publisher=...][&year=N].
+    Each facet is counted with the other filters applied, but not its own.
+    """
+    filters, _ = _library_filters()
+    counts = get_facet_counts(system_name=request.args.get('system') or None,
+                              web_playable_only=request.args.get('playable') == '1', filters=filters)
+    return jsonify(counts)
+
+@navigation_bp.route('/library/search')
+def library_search():
+    """
+    JSON full-text search over the library: ?q=words[&system=...][&playable=1][&limit=N].
+    Results are ranked, best match first, and every word matches as a prefix.
+    """
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 50, type=int), LIBRARY_SEARCH_LIMIT))
+    games = search_games(query, system_name=request.args.get('system') or None,
+                         web_playable_only=request.args.get('playable') == '1', limit=limit)
+    for game in games:
+        game['url'] = url_for('library.game_detail', game_id=game['id'])
+    return jsonify({'query': query, 'results': games})
 
 @navigation_bp.route('/about')
 def about():
@@ -0,0 +1,216 @@
+# blueprints/saves.py - Server-side save states and SRAM for the web emulator
+#
+# Each save is split into fixed-size chunks that are stored once, by SHA-256, under
+# SAVES_FOLDER/chunks. A slot (e.g. "state-1", "sram") is just the ordered list of its
+# chunk hashes, so re-saving a mostly unchanged state, or the same state in several
+# slots, only writes the chunks that differ. Emulator memory dumps keep a fixed layout,
+# which is why fixed-size chunks dedupe them well.
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import zlib
+from collections import Counter
+from flask import Blueprint, current_app, request, jsonify, abort
+import db
+
+saves_bp = Blueprint('saves', __name__)
+
+SAVE_CHUNK_SIZE = 256 * 1024
+SLOT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+# Chunks an in-flight upload has stored or found already on disk, but not yet referenced
+# from a committed slot (hash -> number of uploads). Garbage collection leaves them alone.
+# The lock guards this and is held for slot row swaps and garbage collection, never while
+# a request body is being read.
+_pinned_chunks = Counter()
+_chunk_store_lock = threading.Lock()
+
+def get_db_connection():
+    return db.get_connection(current_app.config['DATABASE'])
+
+def _chunk_path(chunk_hash):
+    return os.path.join(current_app.config['SAVES_FOLDER'], 'chunks', chunk_hash[:2], chunk_hash)
+
+def store_chunk(data):
+    """
+    Stores one chunk (zlib-compressed) unless an identical one exists. Returns (hash, written).
+    The chunk stays pinned against garbage collection until unpin_chunks() is called for it.
+    """
+    chunk_hash = hashlib.sha256(data).hexdigest()
+    with _chunk_store_lock:
+        _pinned_chunks[chunk_hash] += 1
+    path = _chunk_path(chunk_hash)
+    if os.path.exists(path):
+        return chunk_hash, False
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(data, 1))
+        os.replace(temp_path, path)
+    except OSError:
+        with _chunk_store_lock:
+            unpin_chunks([chunk_hash])
+        raise
+    return chunk_hash, True
+
+def unpin_chunks(chunk_hashes):
+    """Releases pins taken by store_chunk(). Caller holds _chunk_store_lock."""
+    for chunk_hash in chunk_hashes:
+        _pinned_chunks[chunk_hash] -= 1
+        if _pinned_chunks[chunk_hash] <= 0:
+            del _pinned_chunks[chunk_hash]
+
+def read_chunk(path):
+    with open(path, 'rb') as f:
+        return zlib.decompress(f.read())
+
+def _read_full(stream, size):
+    """Reads up to `size` bytes from a request stream, which may return short reads."""
+    parts = []
+    remaining = size
+    while remaining:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+def _delete_unreferenced_chunks(conn, chunk_hashes):
+    """
+    Removes chunk files no slot points at any more and no upload has pinned. Call after the
+    slot rows are committed, holding _chunk_store_lock.
+    """
+    for chunk_hash in set(chunk_hashes):
+        if chunk_hash in _pinned_chunks:
+            continue
+        if not conn.execute('SELECT 1 FROM save_slot_chunks WHERE chunk_hash = ? LIMIT 1', (chunk_hash,)).fetchone():
+            try:
+                os.remove(_chunk_path(chunk_hash))
+            except OSError:
+                pass
+
+def _slot_chunk_hashes(conn, slot_id):
+    return [row['chunk_hash'] for row in conn.execute(
+        'SELECT chunk_hash FROM save_slot_chunks WHERE slot_id = ? ORDER BY seq', (slot_id,))]
+
+def _get_slot(conn, game_id, slot):
+    if not SLOT_NAME_PATTERN.match(slot):
+        abort(400, description='Invalid slot name.')
+    return conn.execute('SELECT * FROM save_slots WHERE game_id = ? AND slot = ?', (game_id, slot)).fetchone()
+
+@saves_bp.route('/<int:game_id>')
+def list_saves(game_id):
+    """Lists a game's save slots."""
+    conn = get_db_connection()
+    slots = conn.execute('SELECT slot, size, sha256, updated_at FROM save_slots WHERE game_id = ? ORDER BY slot',
+                         (game_id,)).fetchall()
+    conn.close()
+    return jsonify([dict(slot) for slot in slots])
+
+@saves_bp.route('/<int:game_id>/<string:slot>', methods=['PUT'])
+def put_save(game_id, slot):
+    """
+    Stores the request body as the save in `slot`, replacing what was there. The body is
+    read and chunked as it streams in, so large states never sit whole in memory.
+    Chunks are hashed and written as they arrive; only the slot row swap waits for
+    _chunk_store_lock, so a slow upload does not hold up other saves.
+    """
+    conn = get_db_connection()
+    chunk_hashes = []
+    committed = False
+    try:
+        if not conn.execute('SELECT 1 FROM games WHERE id = ?', (game_id,)).fetchone():
+            abort(404)
+        _get_slot(conn, game_id, slot)  # validates the slot name before the body is read
+
+        max_bytes = current_app.config['SAVE_MAX_BYTES']
+        if request.content_length is not None and request.content_length > max_bytes:
+            abort(413)
+        sha = hashlib.sha256()
+        written = 0
+        size = 0
+        while data := _read_full(request.stream, SAVE_CHUNK_SIZE):
+            size += len(data)
+            if size > max_bytes:
+                abort(413)
+            sha.update(data)
+            chunk_hash, was_written = store_chunk(data)
+            chunk_hashes.append(chunk_hash)
+            written += was_written
+        if size == 0:
+            abort(400, description='Empty save.')
+
+        with _chunk_store_lock:
+            existing = _get_slot(conn, game_id, slot)
+            old_hashes = _slot_chunk_hashes(conn, existing['id']) if existing else []
+            if existing:
+                slot_id = existing['id']
+                conn.execute('UPDATE save_slots SET size = ?, sha256 = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                             (size, sha.hexdigest(), slot_id))
+                conn.execute('DELETE FROM save_slot_chunks WHERE slot_id = ?', (slot_id,))
+            else:
+                slot_id = conn.execute('INSERT INTO save_slots (game_id, slot, size, sha256) VALUES (?, ?, ?, ?)',
+                                       (game_id, slot, size, sha.hexdigest())).lastrowid
+            conn.executemany('INSERT INTO save_slot_chunks (slot_id, seq, chunk_hash) VALUES (?, ?, ?)',
+                             [(slot_id, seq, chunk_hash) for seq, chunk_hash in enumerate(chunk_hashes)])
+            conn.commit()
+            committed = True
+            unpin_chunks(chunk_hashes)
+            _delete_unreferenced_chunks(conn, set(old_hashes) - set(chunk_hashes))
+    finally:
+        if not committed and chunk_hashes:
+            # Rejected (e.g. too large) or failed part-way: drop the chunks it left behind
+            with _chunk_store_lock:
+                unpin_chunks(chunk_hashes)
+                _delete_unreferenced_chunks(conn, chunk_hashes)
+        conn.close()
+
+    current_app.logger.info(f"Saved game {game_id} slot {slot}: {size} bytes, {written}/{len(chunk_hashes)} new chunks")
+    return jsonify({'slot': slot, 'size': size, 'sha256': sha.hexdigest(),
+                    'chunks': len(chunk_hashes), 'new_chunks': written})
+
+@saves_bp.route('/<int:game_id>/<string:slot>', methods=['GET'])
+def get_save(game_id, slot):
+    """Streams a save back, chunk by chunk. The SHA-256 is the ETag, so unchanged saves get a 304."""
+    conn = get_db_connection()
+    try:
+        save = _get_slot(conn, game_id, slot)
+        if not save:
+            abort(404)
+        chunk_hashes = _slot_chunk_hashes(conn, save['id'])
+    finally:
+        conn.close()
+
+    # Paths are worked out here: the generator runs after the app context is gone
+    chunk_paths = [_chunk_path(chunk_hash) for chunk_hash in chunk_hashes]
+
+    def generate():
+        for path in chunk_paths:
+            yield read_chunk(path)
+
+    response = current_app.response_class(generate(), mimetype='application/octet-stream', direct_passthrough=True)
+    response.content_length = save['size']
+    response.set_etag(save['sha256'])
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@saves_bp.route('/<int:game_id>/<string:slot>', methods=['DELETE'])
+def delete_save(game_id, slot):
+    """Deletes a save slot and any chunks only it used."""
+    conn = get_db_connection()
+    try:
+        save = _get_slot(conn, game_id, slot)
+        if not save:
+            abort(404)
+        chunk_hashes = _slot_chunk_hashes(conn, save['id'])
+        with _chunk_store_lock:
+            conn.execute('DELETE FROM save_slot_chunks WHERE slot_id = ?', (save['id'],))
+            conn.execute('DELETE FROM save_slots WHERE id = ?', (save['id'],))
+            conn.commit()
+            _delete_unreferenced_chunks(conn, chunk_hashes)
+    finally:
+        conn.close()
+    return jsonify({'deleted': slot})
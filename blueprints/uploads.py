@@ -0,0 +1,576 @@
+# blueprints/uploads.py - Resumable chunked uploads and background ZIP extraction
+#
+# A client creates an upload (POST), then sends the file in pieces with PATCH requests
+# carrying an Upload-Offset header, tus-style. Bytes are appended straight to a .part file
+# next to the final location, so finishing an upload is a rename rather than a copy, and
+# an interrupted upload resumes from the size of that file. ZIPs are extracted by a
+# background worker; clients poll the upload (or the job) for progress.
+#
+# Batch uploads (many ROMs in one request) are staged, then prepared in parallel by a
+# worker pool and inserted in a single transaction, with results streamed to the client.
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, current_app, request, jsonify, abort
+from werkzeug.utils import secure_filename
+from scanner.core import (get_db_connection, update_rom_index, resolve_web_rom, clean_game_title,
+                          EXTENSION_TO_SYSTEM, ROM_INDEX_COLUMNS)
+from utils import invalidate_game_record
+
+uploads_bp = Blueprint('uploads', __name__)
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # suggested PATCH size sent to clients
+STREAM_READ_SIZE = 1024 * 1024
+
+# Abandoned sessions are looked for at most this often (seconds), when an upload starts
+UPLOAD_SWEEP_INTERVAL = 10 * 60
+
+_upload_locks = {}
+_upload_locks_guard = threading.Lock()
+# Held while a finished upload picks its final name and is renamed into place
+_finish_lock = threading.Lock()
+_last_sweep = 0.0
+
+def _upload_lock(upload_id):
+    with _upload_locks_guard:
+        return _upload_locks.setdefault(upload_id, threading.Lock())
+
+def _forget_upload_lock(upload_id):
+    with _upload_locks_guard:
+        _upload_locks.pop(upload_id, None)
+
+def safe_system_folder(system):
+    """Folder name used for a system under UPLOAD_FOLDER (same rule as the upload form)."""
+    return "".join(c for c in system if c.isalnum() or c in (' ', '_')).strip().replace(' ', '_')
+
+# --- Upload sessions ---
+# Each session is a small JSON file in TEMP_UPLOAD_FOLDER/sessions; the number of bytes
+# received is always the size of the .part file, so nothing else needs updating per chunk.
+# Sessions left untouched for UPLOAD_SESSION_TTL are swept when a new upload starts.
+
+def _session_path(upload_id):
+    if not upload_id.isalnum():
+        abort(404)
+    return os.path.join(current_app.config['TEMP_UPLOAD_FOLDER'], 'sessions', f"{upload_id}.json")
+
+def load_upload(upload_id):
+    try:
+        with open(_session_path(upload_id), 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def _save_upload(upload):
+    path = _session_path(upload['id'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(upload, f)
+    os.replace(temp_path, path)
+
+def _upload_offset(upload):
+    if upload['status'] != 'uploading':
+        return upload['size']
+    try:
+        return os.path.getsize(upload['part_path'])
+    except OSError:
+        return 0
+
+def _upload_status(upload):
+    status = {
+        'upload_id': upload['id'],
+        'filename': upload['filename'],
+        'size': upload['size'],
+        'offset': _upload_offset(upload),
+        'status': upload['status'],
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+    }
+    job = get_extraction_job(upload['id'])
+    if job:
+        status['extraction'] = job
+    return status
+
+def take_completed_upload(upload_id):
+    """
+    Returns the final path of a finished upload and forgets the session, or None if the
+    upload does not exist or is not complete. Used when the upload form is submitted.
+    """
+    with _upload_lock(upload_id):
+        upload = load_upload(upload_id)
+        if not upload or upload['status'] != 'complete':
+            return None
+        os.remove(_session_path(upload_id))
+    _forget_upload_lock(upload_id)
+    return upload['final_path']
+
+def _unique_destination(path):
+    """
+    `path`, or `name_1.ext`, `name_2.ext`, ... if it is taken, so a finished upload never
+    replaces a file already in the library. For a ZIP the folder it will be extracted
+    into must be free as well.
+    """
+    stem, ext = os.path.splitext(path)
+    candidate, n = path, 0
+    while os.path.exists(candidate) or (ext.lower() == '.zip' and os.path.exists(zip_extract_path(candidate))):
+        n += 1
+        candidate = f"{stem}_{n}{ext}"
+    return candidate
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def sweep_stale_uploads(temp_folder, ttl):
+    """
+    Forgets upload sessions nobody has touched for `ttl` seconds: an unfinished upload
+    loses its .part file, and a finished one the upload form never claimed loses the
+    uploaded file, which no game points at. Returns the number of sessions removed.
+    """
+    sessions_dir = os.path.join(temp_folder, 'sessions')
+    try:
+        entries = [e for e in os.scandir(sessions_dir) if e.name.endswith('.json')]
+    except OSError:
+        return 0
+    removed = 0
+    cutoff = time.time() - ttl
+    for entry in entries:
+        upload_id = entry.name[:-len('.json')]
+        with _upload_lock(upload_id):
+            try:
+                with open(entry.path, 'r') as f:
+                    upload = json.load(f)
+                last_active = os.path.getmtime(entry.path)
+            except (OSError, json.JSONDecodeError):
+                continue
+            data_path = upload['part_path'] if upload['status'] == 'uploading' else upload['final_path']
+            try:
+                last_active = max(last_active, os.path.getmtime(data_path))
+            except OSError:
+                pass
+            if last_active > cutoff:
+                continue
+            _remove_quietly(data_path)
+            _remove_quietly(entry.path)
+        _forget_upload_lock(upload_id)
+        removed += 1
+    return removed
+
+def _maybe_sweep_stale_uploads():
+    global _last_sweep
+    now = time.time()
+    with _upload_locks_guard:
+        if now - _last_sweep < UPLOAD_SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+    removed = sweep_stale_uploads(current_app.config['TEMP_UPLOAD_FOLDER'], current_app.config['UPLOAD_SESSION_TTL'])
+    if removed:
+        current_app.logger.info(f"Removed {removed} abandoned upload(s)")
+
+@uploads_bp.route('', methods=['POST'])
+def create_upload():
+    """Starts an upload. JSON body: filename, size (bytes) and system."""
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename', '')))
+    system = str(data.get('system', '')).strip()
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        size = -1
+    if not filename or not system or size < 0:
+        return jsonify({'error': 'filename, size and system are required'}), 400
+    _maybe_sweep_stale_uploads()
+
+    system_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], safe_system_folder(system))
+    os.makedirs(system_dir, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    upload = {
+        'id': upload_id,
+        'filename': filename,
+        'size': size,
+        'system': system,
+        'final_path': os.path.join(system_dir, filename),
+        # Written in the destination folder so completing the upload is a same-disk rename
+        'part_path': os.path.join(system_dir, f".{filename}.{upload_id}.part"),
+        'status': 'uploading',
+        'created': time.time(),
+    }
+    open(upload['part_path'], 'wb').close()
+    _save_upload(upload)
+    current_app.logger.info(f"Upload {upload_id} started: {filename} ({size} bytes) for {system}")
+    response = jsonify(_upload_status(upload))
+    response.status_code = 201
+    response.headers['Location'] = f"{request.path.rstrip('/')}/{upload_id}"
+    return response
+
+@uploads_bp.route('/<string:upload_id>', methods=['GET', 'HEAD'])
+def upload_status(upload_id):
+    """Progress of an upload (and of its extraction job, if any). Upload-Offset says where to resume."""
+    upload = load_upload(upload_id)
+    if not upload:
+        job = get_extraction_job(upload_id)
+        if job:
+            return jsonify({'upload_id': upload_id, 'status': 'complete', 'extraction': job})
+        abort(404)
+    response = jsonify(_upload_status(upload))
+    response.headers['Upload-Offset'] = str(_upload_offset(upload))
+    response.cache_control.no_store = True
+    return response
+
+@uploads_bp.route('/<string:upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    """
+    Appends the request body at Upload-Offset, which must equal the bytes received so far
+    (409 otherwise, with the server's offset, so the client can resume from there).
+    """
+    with _upload_lock(upload_id):
+        upload = load_upload(upload_id)
+        if not upload:
+            abort(404)
+        if upload['status'] != 'uploading':
+            return jsonify(_upload_status(upload)), 409
+
+        current_offset = _upload_offset(upload)
+        try:
+            client_offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return jsonify({'error': 'Upload-Offset header is required'}), 400
+        if client_offset != current_offset:
+            response = jsonify(_upload_status(upload))
+            response.status_code = 409
+            response.headers['Upload-Offset'] = str(current_offset)
+            return response
+
+        remaining = upload['size'] - current_offset
+        with open(upload['part_path'], 'ab') as f:
+            while remaining > 0 and (data := request.stream.read(min(STREAM_READ_SIZE, remaining))):
+                f.write(data)
+                remaining -= len(data)
+        # Bytes beyond the declared size are dropped and the request is rejected
+        overflow = bool(request.stream.read(1))
+
+        if _upload_offset(upload) == upload['size']:
+            with _finish_lock:
+                upload['final_path'] = _unique_destination(upload['final_path'])
+                os.replace(upload['part_path'], upload['final_path'])
+            upload['status'] = 'complete'
+            _save_upload(upload)
+            current_app.logger.info(f"Upload {upload_id} complete: {upload['final_path']}")
+
+    response = jsonify(_upload_status(upload))
+    response.headers['Upload-Offset'] = str(_upload_offset(upload))
+    if overflow:
+        response.status_code = 413
+    return response
+
+@uploads_bp.route('/<string:upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """Abandons an unfinished upload and removes its partial file."""
+    with _upload_lock(upload_id):
+        upload = load_upload(upload_id)
+        if not upload:
+            abort(404)
+        if upload['status'] == 'uploading':
+            _remove_quietly(upload['part_path'])
+        os.remove(_session_path(upload_id))
+    _forget_upload_lock(upload_id)
+    return jsonify({'cancelled': upload_id})
+
+# --- Background ZIP extraction ---
+# Jobs are kept in memory (keyed by upload id, or a generated id for form uploads) so the
+# game page and the uploader can poll them. A couple of workers keep the disk from thrashing.
+
+_extraction_executor = None
+_extraction_jobs = {}
+_extraction_jobs_lock = threading.Lock()
+
+def _get_extraction_executor():
+    global _extraction_executor
+    with _extraction_jobs_lock:
+        if _extraction_executor is None:
+            _extraction_executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('EXTRACTION_WORKERS', 2), thread_name_prefix='extract')
+        return _extraction_executor
+
+def get_extraction_job(job_id):
+    with _extraction_jobs_lock:
+        job = _extraction_jobs.get(job_id)
+        return dict(job) if job else None
+
+def get_extraction_job_for_game(game_id):
+    """The most recent extraction job for a game, if it is still running or failed."""
+    with _extraction_jobs_lock:
+        jobs = [job for job in _extraction_jobs.values() if job['game_id'] == game_id]
+    if not jobs:
+        return None
+    job = max(jobs, key=lambda j: j['started'])
+    return dict(job) if job['status'] != 'done' else None
+
+def _update_job(job_id, **fields):
+    with _extraction_jobs_lock:
+        _extraction_jobs[job_id].update(fields)
+
+def _extract_zip(job_id, zip_path, extract_path, game_id):
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            members = zf.infolist()
+            _update_job(job_id, status='extracting', total_bytes=sum(m.file_size for m in members))
+            done = 0
+            for member in members:
+                zf.extract(member, extract_path)
+                done += member.file_size
+                _update_job(job_id, extracted_bytes=done)
+        os.remove(zip_path)
+        # The extracted files replace the archive as the game's content
+        conn = get_db_connection()
+        try:
+            update_rom_index(conn, game_id, extract_path)
+            conn.commit()
+        finally:
+            conn.close()
+        _update_job(job_id, status='done', finished=time.time())
+    except Exception as e:
+        print(f"Extraction of {zip_path} failed: {e}")
+        _update_job(job_id, status='error', error=str(e), finished=time.time())
+
+def zip_extract_path(zip_path):
+    """Folder an uploaded ZIP is extracted into; it becomes the game's path."""
+    return os.path.splitext(zip_path)[0]
+
+def start_zip_extraction(zip_path, game_id, job_id=None):
+    """
+    Queues extraction of an uploaded ZIP into zip_extract_path(zip_path) and returns the
+    job id. The archive is deleted once extracted and the game's ROM index refreshed.
+    """
+    job_id = job_id or uuid.uuid4().hex
+    extract_path = zip_extract_path(zip_path)
+    os.makedirs(extract_path, exist_ok=True)
+    with _extraction_jobs_lock:
+        _extraction_jobs[job_id] = {
+            'job_id': job_id, 'game_id': game_id, 'status': 'queued', 'error': None,
+            'extracted_bytes': 0, 'total_bytes': None, 'started': time.time(), 'finished': None,
+        }
+    _get_extraction_executor().submit(_extract_zip, job_id, zip_path, extract_path, game_id)
+    invalidate_game_record(game_id)
+    return job_id
+
+@uploads_bp.route('/jobs/<string:job_id>')
+def extraction_status(job_id):
+    """Progress of a background extraction job."""
+    job = get_extraction_job(job_id)
+    if not job:
+        abort(404)
+    response = jsonify(job)
+    response.cache_control.no_store = True
+    return response
+
+# --- Batch ingestion ---
+# The request thread only stages the files; a coordinator thread fans the per-file work
+# (system detection, moving or extracting, ROM resolution) out to a worker pool and then
+# inserts every game in one transaction. Progress events are kept per batch and streamed
+# to the browser as server-sent events.
+
+_batches = {}
+_batches_lock = threading.Lock()
+
+def _detect_system(path, original_name):
+    """Returns (system, title) for a staged ROM or ZIP using EXTENSION_TO_SYSTEM, or (None, None)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.zip':
+        with zipfile.ZipFile(path, 'r') as zf:
+            rom_files = sorted(f for f in zf.namelist() if os.path.splitext(f)[1].lower() in EXTENSION_TO_SYSTEM)
+        if not rom_files:
+            return None, None
+        return EXTENSION_TO_SYSTEM[os.path.splitext(rom_files[0])[1].lower()], clean_game_title(os.path.basename(rom_files[0]))
+    if ext in EXTENSION_TO_SYSTEM:
+        return EXTENSION_TO_SYSTEM[ext], clean_game_title(original_name)
+    return None, None
+
+def _prepare_batch_file(staged_path, original_name, upload_folder):
+    """
+    Worker step for one file: detect its system, move it (or extract it, for ZIPs) into
+    the library and resolve its web ROM. Returns a result dict; nothing touches the DB.
+    """
+    filename = os.path.basename(staged_path)
+    result = {'filename': filename}
+    try:
+        system, title = _detect_system(staged_path, original_name)
+        if not system:
+            result.update(status='error', error='Unrecognised file type')
+            return result
+        system_dir = os.path.join(upload_folder, safe_system_folder(system))
+        os.makedirs(system_dir, exist_ok=True)
+        is_zip = filename.lower().endswith('.zip')
+        final_path = zip_extract_path(os.path.join(system_dir, filename)) if is_zip else os.path.join(system_dir, filename)
+        if os.path.exists(final_path):
+            result.update(status='duplicate', system=system, filepath=final_path)
+            return result
+        if is_zip:
+            with zipfile.ZipFile(staged_path, 'r') as zf:
+                zf.extractall(final_path)
+        else:
+            shutil.move(staged_path, final_path)
+        result.update(status='prepared', system=system, title=title, filepath=final_path,
+                      rom_entry=resolve_web_rom(final_path))
+    except Exception as e:
+        result.update(status='error', error=str(e))
+    finally:
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+    return result
+
+def _batch_event(batch_id, event):
+    batch = _batches[batch_id]
+    with batch['cond']:
+        batch['events'].append(event)
+        batch['cond'].notify_all()
+
+def _insert_batch(results):
+    """Inserts every prepared game (and any new systems) in one transaction."""
+    conn = get_db_connection()
+    index_cols = [col for col, _ in ROM_INDEX_COLUMNS]
+    try:
+        with conn:
+            for result in results:
+                conn.execute('INSERT OR IGNORE INTO systems (name) VALUES (?)', (result['system'],))
+                try:
+                    cursor = conn.execute(
+                        f"INSERT INTO games (title, system, filepath, original_filename, play_status, {', '.join(index_cols)}) "
+                        f"VALUES (?, ?, ?, ?, 'Not Played', {', '.join('?' for _ in index_cols)})",
+                        (result['title'], result['system'], result['filepath'], result['filename'],
+                         *(result['rom_entry'][col] for col in index_cols)))
+                    result.update(status='imported', game_id=cursor.lastrowid)
+                except sqlite3.IntegrityError:
+                    result['status'] = 'duplicate'
+    finally:
+        conn.close()
+
+def _discard_prepared_file(path):
+    """Removes a file (or extracted ZIP folder) that _prepare_batch_file put in the library."""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except OSError as e:
+        print(f"Could not remove {path}: {e}")
+
+def _run_batch(batch_id, staged_files, upload_folder, workers):
+    prepared = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest') as pool:
+        futures = [pool.submit(_prepare_batch_file, path, original_name, upload_folder)
+                   for path, original_name in staged_files]
+        for future in as_completed(futures):
+            result = future.result()
+            if result['status'] == 'prepared':
+                prepared.append(result)
+                # The game row is written with the rest of the batch below
+                _batch_event(batch_id, {'filename': result['filename'], 'status': 'prepared', 'system': result['system']})
+            else:
+                _batch_event(batch_id, {k: v for k, v in result.items() if k != 'rom_entry'})
+    try:
+        _insert_batch(prepared)
+        for result in prepared:
+            _batch_event(batch_id, {k: v for k, v in result.items() if k != 'rom_entry'})
+    except Exception as e:
+        print(f"Batch {batch_id} insert failed: {e}")
+        for result in prepared:
+            # No game row points at the file, so leaving it would make every re-upload a "duplicate"
+            _discard_prepared_file(result['filepath'])
+            _batch_event(batch_id, {'filename': result['filename'], 'status': 'error', 'error': str(e)})
+    batch = _batches[batch_id]
+    with batch['cond']:
+        batch['done'] = True
+        batch['cond'].notify_all()
+    shutil.rmtree(os.path.dirname(staged_files[0][0]), ignore_errors=True)
+
+def start_batch_ingest(files):
+    """
+    Stages uploaded FileStorage objects and starts ingesting them in the background.
+    Returns the batch id, or None if no usable files were given.
+    """
+    batch_id = uuid.uuid4().hex
+    staging_dir = os.path.join(current_app.config['TEMP_UPLOAD_FOLDER'], 'batches', batch_id)
+    os.makedirs(staging_dir, exist_ok=True)
+    staged_files = []
+    for file in files:
+        filename = secure_filename(file.filename or '')
+        if not filename:
+            continue
+        path = os.path.join(staging_dir, filename)
+        if os.path.exists(path):
+            continue  # the same file twice in one batch
+        file.save(path)
+        staged_files.append((path, os.path.basename(file.filename)))
+    if not staged_files:
+        os.rmdir(staging_dir)
+        return None
+
+    with _batches_lock:
+        # Forget batches that finished over an hour ago
+        for old_id in [b for b, info in _batches.items() if info['done'] and info['started'] < time.time() - 3600]:
+            del _batches[old_id]
+        _batches[batch_id] = {'total': len(staged_files), 'events': [], 'done': False,
+                              'cond': threading.Condition(), 'started': time.time()}
+    threading.Thread(target=_run_batch, name=f"batch-{batch_id[:8]}", daemon=True,
+                     args=(batch_id, staged_files, current_app.config['UPLOAD_FOLDER'],
+                           current_app.config.get('BATCH_INGEST_WORKERS', 4))).start()
+    current_app.logger.info(f"Batch {batch_id} started with {len(staged_files)} file(s)")
+    return batch_id
+
+def get_batch_status(batch_id):
+    with _batches_lock:
+        batch = _batches.get(batch_id)
+    if not batch:
+        return None
+    with batch['cond']:
+        return {'batch_id': batch_id, 'total': batch['total'], 'done': batch['done'], 'events': list(batch['events'])}
+
+@uploads_bp.route('/batches/<string:batch_id>')
+def batch_status(batch_id):
+    """Everything reported so far for a batch, as JSON."""
+    status = get_batch_status(batch_id)
+    if not status:
+        abort(404)
+    response = jsonify(status)
+    response.cache_control.no_store = True
+    return response
+
+@uploads_bp.route('/batches/<string:batch_id>/events')
+def batch_events(batch_id):
+    """Streams a batch's results as server-sent events, ending with a 'done' event."""
+    with _batches_lock:
+        batch = _batches.get(batch_id)
+    if not batch:
+        abort(404)
+
+    def generate():
+        sent = 0
+        while True:
+            with batch['cond']:
+                while sent == len(batch['events']) and not batch['done']:
+                    if not batch['cond'].wait(timeout=15):
+                        break
+                events = batch['events'][sent:]
+                done = batch['done']
+            if not events and not done:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                yield f"event: result\ndata: {json.dumps(event)}\n\n"
+            sent += len(events)
+            if done and sent == len(batch['events']):
+                yield f"event: done\ndata: {json.dumps({'total': batch['total']})}\n\n"
+                return
+
+    response = current_app.response_class(generate(), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -33,6 +33,61 @@ class Config:
     # Define themes (if not dynamically loaded from settings.json)
     THEMES = ['modern', 'dark', 'light', 'retro'] # Add more as you create them
 
+    # Anbernic sync server (pc_server.py)
+    PC_SERVER_HOST = os.environ.get('PC_SERVER_HOST') or '0.0.0.0'
+    PC_SERVER_PORT = int(os.environ.get('PC_SERVER_PORT') or 8081)
+    # UDP port answering LAN discovery broadcasts from handhelds
+    PC_SERVER_DISCOVERY_PORT = int(os.environ.get('PC_SERVER_DISCOVERY_PORT') or 8082)
+    # Worker threads running client commands (idle keep-alive connections wait without
+    # holding one). Keep this comfortably above PC_SERVER_MAX_TRANSFERS so listing
+    # commands always find a free worker.
+    PC_SERVER_MAX_WORKERS = int(os.environ.get('PC_SERVER_MAX_WORKERS') or 16)
+    # ROM downloads allowed to run at the same time, server-wide and per device
+    PC_SERVER_MAX_TRANSFERS = int(os.environ.get('PC_SERVER_MAX_TRANSFERS') or 4)
+    PC_SERVER_MAX_CONNECTIONS_PER_CLIENT = int(os.environ.get('PC_SERVER_MAX_CONNECTIONS_PER_CLIENT') or 4)
+    PC_SERVER_MAX_TRANSFERS_PER_CLIENT = int(os.environ.get('PC_SERVER_MAX_TRANSFERS_PER_CLIENT') or 2)
+    # Seconds a client may stall (not reading or not sending) before it is dropped
+    PC_SERVER_CLIENT_TIMEOUT = float(os.environ.get('PC_SERVER_CLIENT_TIMEOUT') or 60)
+    # Seconds a keep-alive session may sit idle between commands before it is closed
+    PC_SERVER_IDLE_TIMEOUT = float(os.environ.get('PC_SERVER_IDLE_TIMEOUT') or 30)
+    # SQLite connections kept open and shared by the worker threads
+    PC_SERVER_DB_POOL_SIZE = int(os.environ.get('PC_SERVER_DB_POOL_SIZE') or 4)
+    # Per-system game lists kept in memory for listing replies
+    PC_SERVER_LIBRARY_CACHE_SYSTEMS = int(os.environ.get('PC_SERVER_LIBRARY_CACHE_SYSTEMS') or 32)
+    # Use kernel zero-copy (sendfile) for ROM downloads where the platform supports it
+    PC_SERVER_USE_SENDFILE = (os.environ.get('PC_SERVER_USE_SENDFILE') or '1') != '0'
+    # Compressed ROM streams are built once and kept here, least recently used evicted first
+    PC_SERVER_CACHE_FOLDER = os.environ.get('PC_SERVER_CACHE_FOLDER') or os.path.join(basedir, 'transfer_cache')
+    PC_SERVER_CACHE_MAX_BYTES = int(os.environ.get('PC_SERVER_CACHE_MAX_BYTES') or 10 * 1024 ** 3)
+
+    # ROMs served to the web emulator out of ZIP archives are decompressed once and kept here,
+    # least recently used evicted first
+    WEB_ROM_CACHE_FOLDER = os.environ.get('WEB_ROM_CACHE_FOLDER') or os.path.join(basedir, 'rom_cache')
+    WEB_ROM_CACHE_MAX_BYTES = int(os.environ.get('WEB_ROM_CACHE_MAX_BYTES') or 2 * 1024 ** 3)
+
+    # Server-side save states and SRAM, stored as deduplicated, compressed chunks
+    SAVES_FOLDER = os.environ.get('SAVES_FOLDER') or os.path.join(basedir, 'saves')
+    SAVE_MAX_BYTES = int(os.environ.get('SAVE_MAX_BYTES') or 256 * 1024 ** 2)
+
+    # Seconds a game's database row is reused across requests (e.g. the emulator page and
+    # the ROM download it triggers). Edits made through the app invalidate it immediately.
+    GAME_RECORD_CACHE_TTL = float(os.environ.get('GAME_RECORD_CACHE_TTL') or 10)
+
+    # Seconds an upload session may go untouched before it and its partial (or unclaimed) file are removed
+    UPLOAD_SESSION_TTL = float(os.environ.get('UPLOAD_SESSION_TTL') or 24 * 60 * 60)
+
+    # Background workers extracting uploaded ZIPs (kept low so extraction does not starve the disk)
+    EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS') or 2)
+
+    # Worker threads preparing files (system detection, moving, extraction) in a batch upload
+    BATCH_INGEST_WORKERS = int(os.environ.get('BATCH_INGEST_WORKERS') or 4)
+
+    # SQLite tuning shared by the web app, scanner and pc_server (see db.py)
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB') or 16 * 1024)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 ** 2)
+    # Seconds a connection waits for another writer before giving up with "database is locked"
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT') or 10)
+
     # Other settings can go here if needed for different environments
     DEBUG = True # For development
     # TESTING = False
\ No newline at end of file
@@ -0,0 +1,80 @@
+# db.py - Shared SQLite access for the web app, the scanner GUI and pc_server
+#
+# Every connection is opened the same way: WAL journaling, so readers never wait for a
+# writer and a writer only waits for another writer (not for every reader, as with the
+# default rollback journal); synchronous=NORMAL, which is crash-safe in WAL mode; a larger
+# page cache and memory-mapped reads; and a busy timeout, so a briefly locked database
+# means a short wait rather than "database is locked".
+#
+# get_connection() hands each thread one long-lived connection per database file, so the
+# connection setup and sqlite3's prepared-statement cache are paid for once, not per call.
+import os
+import sqlite3
+import threading
+from config import Config
+
+# Prepared statements kept per connection (sqlite3's default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+class ReusableConnection(sqlite3.Connection):
+    """
+    A thread's shared connection. Callers keep the usual get/close pairing: close() only
+    marks the borrow as finished, and any transaction left open is rolled back once the
+    outermost borrower has closed, so the next borrower starts clean.
+    """
+    borrowers = 0
+
+    def close(self):
+        self.borrowers = max(self.borrowers - 1, 0)
+        if self.borrowers == 0 and self.in_transaction:
+            self.rollback()
+
+    def dispose(self):
+        """Really closes the connection."""
+        super().close()
+
+def apply_pragmas(conn):
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{int(Config.SQLITE_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(Config.SQLITE_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+def connect(path, check_same_thread=True, factory=sqlite3.Connection):
+    """Opens a new tuned connection with sqlite3.Row rows. The caller owns (and closes) it."""
+    conn = sqlite3.connect(path, timeout=Config.SQLITE_BUSY_TIMEOUT, check_same_thread=check_same_thread,
+                           cached_statements=STATEMENT_CACHE_SIZE, factory=factory)
+    conn.row_factory = sqlite3.Row
+    apply_pragmas(conn)
+    return conn
+
+_local = threading.local()
+
+def get_connection(path):
+    """
+    Returns this thread's connection to the database at `path`, opening it on first use.
+    Close it as usual when done; it stays open for the thread's next caller.
+    """
+    connections = _local.__dict__.setdefault('connections', {})
+    key = os.path.abspath(path)
+    conn = connections.get(key)
+    if conn is None:
+        conn = connections[key] = connect(path, factory=ReusableConnection)
+    conn.borrowers += 1
+    return conn
+
+def release_thread_connections():
+    """
+    Ends every borrow on this thread's connections and rolls back anything left open,
+    e.g. by a request that was aborted before it could close its connection.
+    """
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.borrowers = 0
+        if conn.in_transaction:
+            conn.rollback()
+
+def close_thread_connections():
+    """Closes this thread's connections (for threads that outlive their database use)."""
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.dispose()
+    _local.connections = {}
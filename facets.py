@@ -0,0 +1,66 @@
+# facets.py - Normalized genres, developers and publishers for library filters and counts
+#
+# games.genre, developer and publisher stay the comma-joined strings that the edit forms
+# and the IGDB lookup produce. Each name is also stored once in a lookup table (genres,
+# developers, publishers) and linked to its games through a junction table, so "all Capcom
+# games" or "games per genre" are index lookups rather than LIKE '%...%' scans.
+# Triggers on games (migrations.py) keep the links in step with every insert, update and
+# delete, whichever code or tool writes the row.
+
+# games column -> (lookup table, junction table, junction key column), as migrations.FACET_SCHEMA creates them
+FACET_TABLES = {
+    'genre': ('genres', 'game_genres', 'genre_id'),
+    'developer': ('developers', 'game_developers', 'developer_id'),
+    'publisher': ('publishers', 'game_publishers', 'publisher_id'),
+}
+# Everything the library can filter on and count: the normalized names plus two plain columns
+FACET_FIELDS = ['system', 'genre', 'developer', 'publisher', 'release_year']
+# Most values listed per facet
+FACET_VALUE_LIMIT = 50
+
+def facet_conditions(filters, alias='games'):
+    """
+    SQL conditions (and their parameters) keeping only games that match every filter in
+    `filters`, a {FACET_FIELDS name: value} dict. Empty values and unknown fields are ignored.
+    Names match case-insensitively.
+    """
+    conditions, params = [], []
+    for field, value in (filters or {}).items():
+        if value in (None, ''):
+            continue
+        if field in FACET_TABLES:
+            table, junction, key = FACET_TABLES[field]
+            conditions.append(f"{alias}.id IN (SELECT j.game_id FROM {junction} j JOIN {table} t ON t.id = j.{key} "
+                              f"WHERE t.name = ?)")
+        elif field in FACET_FIELDS:
+            conditions.append(f"{alias}.{field} = ?")
+        else:
+            continue
+        params.append(value)
+    return conditions, params
+
+def facet_counts(conn, filters=None, web_playable_only=False, limit=FACET_VALUE_LIMIT):
+    """
+    Counts matching games per value of every FACET_FIELDS field, most common first:
+    {'genre': [{'value': 'Platformer', 'count': 12}, ...], ...}. Each field is counted with
+    all the other filters applied but not its own, so a sidebar can offer the alternatives.
+    """
+    filters = filters or {}
+    counts = {}
+    for field in FACET_FIELDS:
+        conditions, params = facet_conditions({f: v for f, v in filters.items() if f != field})
+        if web_playable_only:
+            conditions.append("games.is_web_playable = 1")
+        if field in FACET_TABLES:
+            table, junction, key = FACET_TABLES[field]
+            # Unfiltered counts come straight from the junction table's primary key
+            join = " JOIN games ON games.id = j.game_id" if conditions else ""
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            sql = (f"SELECT t.name AS value, COUNT(*) AS count FROM {junction} j JOIN {table} t ON t.id = j.{key}"
+                   f"{join}{where} GROUP BY j.{key} ORDER BY count DESC, t.name LIMIT ?")
+        else:
+            conditions.append(f"games.{field} IS NOT NULL")
+            sql = (f"SELECT games.{field} AS value, COUNT(*) AS count FROM games WHERE {' AND '.join(conditions)} "
+                   f"GROUP BY games.{field} ORDER BY count DESC, value LIMIT ?")
+        counts[field] = [dict(row) for row in conn.execute(sql, params + [limit])]
+    return counts
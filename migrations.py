@@ -0,0 +1,405 @@
+# migrations.py - Versioned schema for the library database
+#
+# PRAGMA user_version records the last migration applied to a database. migrate() runs
+# only the steps after it, all in one transaction, so opening an up-to-date database
+# costs a single pragma read. Databases from before versioning start at 0 and may
+# already have any subset of the tables and columns, which is why the early steps use
+# IF NOT EXISTS and check for columns before adding them.
+#
+# To change the schema, append a step to MIGRATIONS. Never edit a step that has shipped.
+import sqlite3
+
+# --- Web ROM resolution index ---
+# Which file the web emulator serves for a game is worked out once (at import, or when the
+# files change) and stored on the game row, so serving a ROM is a single lookup.
+ROM_INDEX_COLUMNS = [
+    ("web_rom_path", "TEXT"), ("web_rom_name", "TEXT"), ("is_web_playable", "INTEGER DEFAULT 0"),
+    ("web_rom_size", "INTEGER"), ("web_rom_mtime", "INTEGER"), ("rom_source_mtime", "INTEGER"),
+    ("web_rom_member", "TEXT"),
+]
+# Lets the library grid filter (and order) web-playable games without a table scan
+ROM_INDEX_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_games_web_playable ON games (is_web_playable, system, title)"
+
+# The library grid is paged by keyset on (title, id). SQLite appends the rowid (id) to every
+# index entry, so these indexes already order by (title, id) and (system, title, id).
+LIBRARY_INDEX_SQL = [
+    "CREATE INDEX IF NOT EXISTS idx_games_title ON games (title)",
+    "CREATE INDEX IF NOT EXISTS idx_games_system_title ON games (system, title)",
+]
+
+# games_fts is an external-content FTS5 index over the games table: it stores only the
+# tokens and reads the text back from games, and its triggers keep it in step with every
+# INSERT, UPDATE and DELETE. System is indexed too, so "snes mario" works.
+SEARCH_COLUMNS = ["title", "system", "developer", "publisher", "genre", "description"]
+
+# Genre/developer/publisher tables as the migrations create them (facets.FACET_TABLES
+# mirrors this): games column -> (lookup table, junction table, junction key column)
+FACET_SCHEMA = {
+    'genre': ('genres', 'game_genres', 'genre_id'),
+    'developer': ('developers', 'game_developers', 'developer_id'),
+    'publisher': ('publishers', 'game_publishers', 'publisher_id'),
+}
+
+# Systems every library starts with: (name, emulator_core, aspect_ratio, image_path)
+DEFAULT_SYSTEMS = [
+    ('Nintendo Entertainment System', 'nestopia', '8/7', 'nes.png'),
+    ('Super Nintendo', 'snes9x', '4/3', 'snes.png'),
+    ('Game Boy', 'gambatte', '10/9', 'gb.png'),
+    ('Game Boy Color', 'gambatte', '10/9', 'gbc.png'),
+    ('Game Boy Advance', 'mgba', '3/2', 'gba.png'),
+    ('Sega Genesis', 'genesis_plus_gx', '4/3', 'sg.png'),
+    ('Sega Master Drive', None, '4/3', 'smd.png'),
+    ('Sega Saturn', None, '4/3', 'ss.png'),
+    ('Sega Dreamcast', None, '4/3', 'sdc.png'),
+    ('Nintendo 64', None, '4/3', 'n64.png'),
+    ('Nintendo DS', None, '4/3', 'nds.png'),
+    ('Nintendo Wii', None, '4/3', 'wii.png'),
+    ('Nintendo GameCube', None, '4/3', 'ngc.png'),
+    ('PlayStation 1', None, '4/3', 'ps1.png'),
+    ('PlayStation 2', None, '4/3', 'ps2.png'),
+    ('PlayStation 3', None, '4/3', 'ps4.png'),
+    ('PlayStation Portable', None, '4/3', 'psp.png'),
+    ('Xbox', None, '4/3', 'xbox.png'),
+    ('Xbox 360', None, '4/3', '360.png'),
+    ('Xbox One', None, '4/3', 'xb1.png'),
+    ('Nintendo 3DS', None, '4/3', '3ds.png'),
+    ('Arcade', None, '4/3', None),
+    ('Other', None, None, None)
+]
+
+def _table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _add_missing_columns(conn, table, columns):
+    """Adds the (name, type) columns a table lacks. Returns the names that were added."""
+    existing = _table_columns(conn, table)
+    added = []
+    for col, col_type in columns:
+        if col not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
+            added.append(col)
+    return added
+
+def _create_core_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            system TEXT NOT NULL,
+            filepath TEXT NOT NULL UNIQUE,
+            cover_image_path TEXT,
+            genre TEXT,
+            release_year INTEGER,
+            developer TEXT,
+            publisher TEXT,
+            description TEXT,
+            play_status TEXT DEFAULT 'Not Played',
+            last_played TEXT,
+            play_count INTEGER DEFAULT 0,
+            original_filename TEXT,
+            FOREIGN KEY (system) REFERENCES systems(name) ON DELETE CASCADE
+        )''')
+    # Libraries created by older versions (or by the scanner) may lack some of these
+    _add_missing_columns(conn, 'games', [
+        ("play_status", "TEXT DEFAULT 'Not Played'"), ("description", "TEXT"), ("publisher", "TEXT"),
+        ("developer", "TEXT"), ("release_year", "INTEGER"), ("genre", "TEXT"),
+        ("original_filename", "TEXT"), ("cover_image_path", "TEXT"),
+        ("last_played", "TEXT"), ("play_count", "INTEGER DEFAULT 0"),
+    ])
+    # The old 'cover_url' column was replaced by cover_image_path
+    if 'cover_url' in _table_columns(conn, 'games'):
+        try:
+            conn.execute("ALTER TABLE games DROP COLUMN cover_url")
+        except sqlite3.OperationalError as e:
+            print(f"Could not remove the old 'cover_url' column: {e}")
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS systems (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            emulator_core TEXT,
+            aspect_ratio TEXT,
+            image_path TEXT
+        )''')
+    _add_missing_columns(conn, 'systems', [
+        ("emulator_core", "TEXT"), ("aspect_ratio", "TEXT"), ("image_path", "TEXT"),
+    ])
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS emulator_configs (
+            emulator_name TEXT PRIMARY KEY,
+            emulator_path TEXT,
+            install_type TEXT
+        )''')
+
+def _seed_systems(conn):
+    conn.executemany('INSERT OR IGNORE INTO systems (name, emulator_core, aspect_ratio, image_path) VALUES (?, ?, ?, ?)',
+                     DEFAULT_SYSTEMS)
+
+def _create_change_log(conn):
+    # Change log for the handheld delta sync (pc_server GET_CHANGES_SINCE).
+    # Only the fields the handhelds list (title, system, filepath) count as a change,
+    # and each game keeps just its latest entry so the log stays the size of the library.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS game_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_game_changes_game_id ON game_changes (game_id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS games_log_insert AFTER INSERT ON games BEGIN
+            DELETE FROM game_changes WHERE game_id = NEW.id;
+            INSERT INTO game_changes (game_id, op) VALUES (NEW.id, 'upsert');
+        END''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS games_log_update AFTER UPDATE OF title, system, filepath ON games BEGIN
+            DELETE FROM game_changes WHERE game_id = NEW.id;
+            INSERT INTO game_changes (game_id, op) VALUES (NEW.id, 'upsert');
+        END''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS games_log_delete AFTER DELETE ON games BEGIN
+            DELETE FROM game_changes WHERE game_id = OLD.id;
+            INSERT INTO game_changes (game_id, op) VALUES (OLD.id, 'delete');
+        END''')
+
+def _add_rom_index(conn):
+    if _add_missing_columns(conn, 'games', ROM_INDEX_COLUMNS):
+        # Stored ROM resolutions predate the new columns; have them redone on next use
+        conn.execute("UPDATE games SET rom_source_mtime = NULL")
+    conn.execute(ROM_INDEX_INDEX_SQL)
+
+def _create_save_slots(conn):
+    # Server-side saves (blueprints/saves.py). A slot is an ordered list of chunk
+    # hashes; the chunk bytes live once each in SAVES_FOLDER, shared by every slot.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS save_slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_id INTEGER NOT NULL,
+            slot TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (game_id, slot),
+            FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE
+        )''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS save_slot_chunks (
+            slot_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            chunk_hash TEXT NOT NULL,
+            PRIMARY KEY (slot_id, seq),
+            FOREIGN KEY (slot_id) REFERENCES save_slots(id) ON DELETE CASCADE
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_save_slot_chunks_hash ON save_slot_chunks (chunk_hash)')
+
+def _add_library_indexes(conn):
+    for sql in LIBRARY_INDEX_SQL:
+        conn.execute(sql)
+
+def _create_search_index(conn):
+    columns = ", ".join(SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{col}" for col in SEARCH_COLUMNS)
+    new_values = ", ".join(f"new.{col}" for col in SEARCH_COLUMNS)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'games_fts'").fetchone()
+    try:
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS games_fts USING fts5({columns}, content='games', "
+                     f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    except sqlite3.OperationalError as e:
+        # search_games() falls back to substring matching without the index
+        print(f"Full-text search unavailable ({e}); falling back to substring search.")
+        return
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS games_fts_insert AFTER INSERT ON games BEGIN "
+                 f"INSERT INTO games_fts (rowid, {columns}) VALUES (new.id, {new_values}); END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS games_fts_delete AFTER DELETE ON games BEGIN "
+                 f"INSERT INTO games_fts (games_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS games_fts_update AFTER UPDATE OF {columns} ON games BEGIN "
+                 f"INSERT INTO games_fts (games_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                 f"INSERT INTO games_fts (rowid, {columns}) VALUES (new.id, {new_values}); END")
+    if not exists:
+        conn.execute("INSERT INTO games_fts (games_fts) VALUES ('rebuild')")
+
+def _link_game_facets_v8(conn, row):
+    # Migration 8's backfill, frozen here so later changes to facets.py cannot alter it
+    for column, (table, junction, key) in FACET_SCHEMA.items():
+        names, seen = [], set()
+        for name in str(row[column] or '').split(','):
+            name = name.strip()
+            if name and name.lower() not in seen:
+                seen.add(name.lower())
+                names.append(name)
+        conn.execute(f"DELETE FROM {junction} WHERE game_id = ?", (row['id'],))
+        for name in names:
+            found = conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()
+            name_id = found[0] if found else conn.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,)).lastrowid
+            conn.execute(f"INSERT OR IGNORE INTO {junction} ({key}, game_id) VALUES (?, ?)", (name_id, row['id']))
+
+def _create_facet_tables(conn):
+    # Normalized genres/developers/publishers (see facets.py). The junction tables are keyed
+    # by (name id, game id), so counting games per name never touches the games table.
+    for table, junction, key in FACET_SCHEMA.values():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     f"name TEXT NOT NULL UNIQUE COLLATE NOCASE)")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {junction} ({key} INTEGER NOT NULL, game_id INTEGER NOT NULL, "
+                     f"PRIMARY KEY ({key}, game_id)) WITHOUT ROWID")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{junction}_game_id ON {junction} (game_id)")
+    deletes = " ".join(f"DELETE FROM {junction} WHERE game_id = OLD.id;" for _, junction, _ in FACET_SCHEMA.values())
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS games_facets_delete AFTER DELETE ON games BEGIN {deletes} END")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_games_release_year ON games (release_year)")
+    rows = conn.execute("SELECT id, genre, developer, publisher FROM games "
+                        "WHERE genre IS NOT NULL OR developer IS NOT NULL OR publisher IS NOT NULL").fetchall()
+    for row in rows:
+        _link_game_facets_v8(conn, row)
+
+def _track_previous_systems(conn):
+    # A handheld that syncs only some systems needs a delete when a game leaves one of its
+    # systems, but not for every change to games it never had. Each log entry now records
+    # previous_systems: the comma-separated systems the game had before the changes the
+    # entry stands for. Entries are collapsed to one per game, so the list carries over
+    # from the entry being replaced. NULL (entries written before this step) means unknown.
+    _add_missing_columns(conn, 'game_changes', [("previous_systems", "TEXT")])
+    merged = ("SELECT CASE WHEN prior.found = 0 THEN OLD.system "
+              "WHEN prior.systems IS NULL THEN NULL "
+              "WHEN instr(',' || prior.systems || ',', ',' || OLD.system || ',') > 0 THEN prior.systems "
+              "ELSE prior.systems || ',' || OLD.system END "
+              "FROM (SELECT COUNT(*) AS found, MAX(previous_systems) AS systems "
+              "FROM game_changes WHERE game_id = OLD.id) AS prior")
+    conn.execute("DROP TRIGGER IF EXISTS games_log_update")
+    conn.execute("DROP TRIGGER IF EXISTS games_log_delete")
+    conn.execute(f'''
+        CREATE TRIGGER games_log_update AFTER UPDATE OF title, system, filepath ON games BEGIN
+            INSERT INTO game_changes (game_id, op, previous_systems) SELECT NEW.id, 'upsert', ({merged});
+            DELETE FROM game_changes WHERE game_id = NEW.id
+                AND seq < (SELECT MAX(seq) FROM game_changes WHERE game_id = NEW.id);
+        END''')
+    conn.execute(f'''
+        CREATE TRIGGER games_log_delete AFTER DELETE ON games BEGIN
+            INSERT INTO game_changes (game_id, op, previous_systems) SELECT OLD.id, 'delete', ({merged});
+            DELETE FROM game_changes WHERE game_id = OLD.id
+                AND seq < (SELECT MAX(seq) FROM game_changes WHERE game_id = OLD.id);
+        END''')
+
+def _add_playable_title_index(conn):
+    # "Playable only" across all systems pages by (title, id); idx_games_web_playable leads
+    # with system after is_web_playable, so that listing needed a temporary sort
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_games_web_playable_title ON games (is_web_playable, title)")
+
+def _add_unindexed_rom_index(conn):
+    # Start-up resolves only games never indexed (rom_source_mtime IS NULL). A partial
+    # index over just those rows makes that check a lookup instead of a table scan.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_games_rom_unindexed ON games (id) WHERE rom_source_mtime IS NULL")
+
+def _facet_names_sql(value):
+    # SQL turning a comma-joined games column into a JSON array of its names, for
+    # json_each(): '["Capcom"," Nintendo"]'. Quotes and backslashes are escaped and tabs or
+    # line breaks become spaces; anything else that is not valid JSON gives '[]'.
+    escaped = (f"replace(replace(replace(replace(replace({value}, '\\', '\\\\'), '\"', '\\\"'), "
+               f"char(9), ' '), char(10), ' '), char(13), ' ')")
+    array = f"""'["' || replace({escaped}, ',', '","') || '"]'"""
+    return f"CASE WHEN json_valid({array}) THEN {array} ELSE '[]' END"
+
+def _facet_link_sql(column, table, junction, key, game, source=''):
+    # The two statements linking games to each name in their `column`, adding names the
+    # lookup table lacks. `game` is NEW inside a trigger; the backfill passes games, with
+    # source='games, ' so it runs over every row.
+    names = f"{source}json_each({_facet_names_sql(f'{game}.{column}')}) AS n"
+    return [f"INSERT OR IGNORE INTO {table} (name) SELECT DISTINCT trim(n.value) FROM {names} "
+            f"WHERE trim(n.value) <> '' AND NOT EXISTS (SELECT 1 FROM {table} WHERE name = trim(n.value))",
+            f"INSERT OR IGNORE INTO {junction} ({key}, game_id) SELECT t.id, {game}.id FROM {names} "
+            f"JOIN {table} t ON t.name = trim(n.value)"]
+
+def _create_facet_triggers(conn):
+    # Until now only the Python write paths kept the facet links up to date; batch uploads,
+    # the scanner and plain SQL left them stale. Triggers keep them in step with every write,
+    # as the games_fts triggers do for search. The links are rebuilt once here.
+    link_new = "".join(f"{sql}; " for column, tables in FACET_SCHEMA.items()
+                       for sql in _facet_link_sql(column, *tables, 'NEW'))
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS games_facets_insert AFTER INSERT ON games BEGIN {link_new}END")
+    for column, (table, junction, key) in FACET_SCHEMA.items():
+        link = "".join(f"{sql}; " for sql in _facet_link_sql(column, table, junction, key, 'NEW'))
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS games_facets_update_{column} AFTER UPDATE OF {column} ON games "
+                     f"BEGIN DELETE FROM {junction} WHERE game_id = NEW.id; {link}END")
+        conn.execute(f"DELETE FROM {junction}")
+        for sql in _facet_link_sql(column, table, junction, key, 'games', source='games, '):
+            conn.execute(sql)
+
+def _log_inserts_with_no_previous_system(conn):
+    # Migration 3's insert trigger left previous_systems NULL ("unknown"), so every new
+    # game was also sent as a delete to devices syncing other systems. A new game was in
+    # no system before, which is '' (known: none).
+    conn.execute("DROP TRIGGER IF EXISTS games_log_insert")
+    conn.execute('''
+        CREATE TRIGGER games_log_insert AFTER INSERT ON games BEGIN
+            DELETE FROM game_changes WHERE game_id = NEW.id;
+            INSERT INTO game_changes (game_id, op, previous_systems) VALUES (NEW.id, 'upsert', '');
+        END''')
+
+# (version, description, step). Versions are consecutive and never reused.
+MIGRATIONS = [
+    (1, "core tables", _create_core_tables),
+    (2, "default systems", _seed_systems),
+    (3, "handheld sync change log", _create_change_log),
+    (4, "web ROM index", _add_rom_index),
+    (5, "save slots", _create_save_slots),
+    (6, "library listing indexes", _add_library_indexes),
+    (7, "full-text search index", _create_search_index),
+    (8, "genre, developer and publisher tables", _create_facet_tables),
+    (9, "previous systems in the change log", _track_previous_systems),
+    (10, "web-playable title index", _add_playable_title_index),
+    (11, "unindexed web ROM index", _add_unindexed_rom_index),
+    (12, "genre, developer and publisher triggers", _create_facet_triggers),
+    (13, "no previous system for new games", _log_inserts_with_no_previous_system),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def ensure_search_index(conn):
+    """
+    Builds games_fts if step 7 had to skip it because SQLite lacked FTS5, once an SQLite
+    with FTS5 opens the database. Costs one sqlite_master lookup when the index exists.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'games_fts'").fetchone():
+        return
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _create_search_index(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def migrate(conn):
+    """
+    Brings the database up to SCHEMA_VERSION. Does nothing beyond a pragma read and the
+    ensure_search_index() check when it is already current. The pending steps run in a
+    single write transaction, so concurrent starters (web app, scanner) apply them once and
+    a failed step leaves nothing behind. Returns the schema version.
+    """
+    version = get_schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        if version > SCHEMA_VERSION:
+            print(f"Database schema version {version} is newer than this code ({SCHEMA_VERSION}).")
+        ensure_search_index(conn)
+        return version
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have migrated while we waited for the write lock
+        version = get_schema_version(conn)
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"Applying database migration {number}: {description}...")
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return SCHEMA_VERSION
@@ -1,12 +1,31 @@
 import os
 import sqlite3
+import hashlib
+import itertools
 import json
+import queue
+import select
+import selectors
 import socket
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
+# Optional: zstd is offered to clients only when the zstandard package is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # --- Integration with your existing project ---
 try:
     from config import Config
+    import db
 except ImportError:
     print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
     print("!!! ERROR: Could not find config.py.")
@@ -16,163 +35,1225 @@ except ImportError:
     input("Press Enter to exit.")
     exit()
 
+# Size of the userspace buffer used when zero-copy sendfile is unavailable
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+# --- Wire protocol ---
+# Reported by LAN discovery. 2 = framed requests, sessions, ranged/compressed downloads, delta sync
+PROTOCOL_VERSION = 2
+DISCOVERY_SERVICE = 'pergamespace'
+DISCOVERY_REQUEST = b'PGS_DISCOVER'
+# Framed requests/responses are prefixed with a 4-byte big-endian length
+FRAME_HEADER = struct.Struct('>I')
+MAX_REQUEST_SIZE = 64 * 1024
+# Listing replies are flushed to the socket in chunks of about this size
+RESPONSE_CHUNK_SIZE = 64 * 1024
+ROW_BATCH_SIZE = 500
+# How a connection talks to us: one bare command per connection (the original protocol),
+# a keep-alive text session of newline-terminated commands, or length-prefixed frames.
+PROTOCOL_LEGACY = 'legacy'
+PROTOCOL_SESSION = 'session'
+PROTOCOL_FRAMED = 'framed'
+# Legacy commands at least this long may have been split across TCP segments
+LEGACY_SPLIT_THRESHOLD = 1024
+LEGACY_READ_GRACE = 0.05
+
 def get_db_connection():
     """Establishes a connection to the SQLite database."""
     db_path = Path(Config.DATABASE)
     if not db_path.exists():
         print(f"!!! ERROR: Database not found at '{db_path}'")
         return None
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled connections move between worker threads, so they are not thread-bound
+    return db.connect(str(db_path), check_same_thread=False)
+
+class ConnectionPool:
+    """
+    A small pool of SQLite connections shared by the worker threads, so commands reuse
+    open connections instead of connecting and closing on every call.
+    """
+    def __init__(self, size):
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection for the duration of a with-block. Yields None if the database is missing."""
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = get_db_connection()
+            yield conn
+        finally:
+            if conn:
+                # Never hand a connection with an open read transaction to the next borrower
+                conn.rollback()
+                self._idle.put(conn)
+            self._slots.release()
+
+db_pool = ConnectionPool(Config.PC_SERVER_DB_POOL_SIZE)
+
+class LibraryCache:
+    """
+    In-memory copy of the listing data (system counts and per-system game lists) so
+    listing replies are served without running queries. Everything is dropped as soon as
+    SQLite's data_version shows another connection (the web app or the scanner) has
+    committed a change to the database. Game lists are kept only for systems that have
+    games, and at most `max_systems` of them, least recently used dropped first.
+    """
+    def __init__(self, max_systems):
+        self.max_systems = max_systems
+        self._lock = threading.Lock()
+        self._watch_conn = None
+        self._data_version = None
+        self._systems = None
+        self._games = OrderedDict()
+
+    def _check_version(self):
+        # data_version is per connection and only moves when *other* connections commit,
+        # so it is always read through the same dedicated connection. Caller holds the lock.
+        if self._watch_conn is None:
+            self._watch_conn = get_db_connection()
+            if self._watch_conn is None:
+                return None
+        version = self._watch_conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._systems = None
+            self._games.clear()
+        return version
+
+    def _get(self, key, load):
+        with self._lock:
+            version = self._check_version()
+            cached = self._systems if key is None else self._games.get(key)
+            if key is not None and cached is not None:
+                self._games.move_to_end(key)
+        if cached is not None:
+            return cached
+        data = load()
+        with self._lock:
+            # Only keep the result if nothing changed while it was being loaded
+            if version is not None and version == self._check_version():
+                if key is None:
+                    self._systems = data
+                else:
+                    self._games[key] = data
+                    while len(self._games) > self.max_systems:
+                        self._games.popitem(last=False)
+        return data
+
+    def systems(self):
+        return self._get(None, _load_systems_data)
+
+    def games_for_system(self, system_name):
+        # Clients can send any system name; one without games gets an empty list
+        # straight away instead of a query and a cache entry of its own.
+        if not any(row['system'] == system_name for row in self.systems()):
+            return []
+        return self._get(system_name, lambda: _load_games_for_system(system_name))
+
+library_cache = LibraryCache(Config.PC_SERVER_LIBRARY_CACHE_SYSTEMS)
+
+def _load_systems_data():
+    with db_pool.connection() as conn:
+        if not conn:
+            return []
+        cursor = conn.execute('SELECT system, COUNT(*) as total FROM games GROUP BY system ORDER BY system')
+        return [dict(row) for row in cursor.fetchall()]
+
+def _load_games_for_system(system_name):
+    with db_pool.connection() as conn:
+        if not conn:
+            return []
+        cursor = conn.execute("SELECT id, title, filepath FROM games WHERE system = ? ORDER BY title", (system_name,))
+        return [dict(row) for row in cursor.fetchall()]
 
 def get_systems_data():
     """Fetches the list of systems and their game counts."""
-    data = []
-    try:
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT system, COUNT(*) as total FROM games GROUP BY system ORDER BY system')
-            data = [dict(row) for row in cursor.fetchall()]
-            conn.close()
+    try:
+        return library_cache.systems()
     except Exception as e:
         print(f"Database error in get_systems_data: {e}")
-    return data
+        return []
 
-def get_games_for_system(system_name):
-    """Fetches the list of games for a given system."""
-    data = []
-    try:
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, title, filepath FROM games WHERE system = ? ORDER BY title", (system_name,))
-            data = [dict(row) for row in cursor.fetchall()]
-            conn.close()
+def _iter_query(query, params, label):
+    """
+    Yields rows of a query as dicts, fetching from the cursor in batches so memory stays flat.
+    A database error is logged and re-raised: the reply is already under way, and ending
+    it normally would hand the client a truncated listing that looks complete.
+    """
+    try:
+        with db_pool.connection() as conn:
+            if not conn:
+                return
+            cursor = conn.execute(query, params)
+            while rows := cursor.fetchmany(ROW_BATCH_SIZE):
+                for row in rows:
+                    yield dict(row)
+    except Exception as e:
+        print(f"Database error in {label}: {e}")
+        raise
+
+def iter_games_for_system(system_name):
+    """Returns the games for a given system, ordered by title."""
+    try:
+        return iter(library_cache.games_for_system(system_name))
     except Exception as e:
         print(f"Database error in get_games_for_system: {e}")
-    return data
+        return iter([])
 
-def get_all_games_for_systems(systems_str):
-    """Fetches all games for a comma-separated list of systems."""
-    data = []
-    system_list = [s.strip() for s in systems_str.split(',')]
-    if not system_list: return []
-    try:
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            placeholders = ','.join('?' for _ in system_list)
-            query = f"SELECT id, title, filepath, system FROM games WHERE system IN ({placeholders}) ORDER BY system, title"
-            cursor.execute(query, system_list)
-            data = [dict(row) for row in cursor.fetchall()]
-            conn.close()
+def iter_all_games_for_systems(systems_str):
+    """Yields all games for a comma-separated list of systems, ordered by system and title."""
+    # Same ordering as "ORDER BY system, title": SQLite's default collation compares
+    # UTF-8 bytes, which sorts the same as Python's code point comparison.
+    try:
+        for system in sorted({s.strip() for s in systems_str.split(',')}):
+            for game in library_cache.games_for_system(system):
+                yield {**game, 'system': system}
     except Exception as e:
         print(f"Database error in get_all_games_for_systems: {e}")
-    return data
+        raise
 
-def send_game_file(conn, game_id):
-    """Finds a game by ID, uses its absolute path, and sends the file."""
+def get_games_for_system(system_name):
+    """Fetches the list of games for a given system."""
+    return list(iter_games_for_system(system_name))
+
+def get_all_games_for_systems(systems_str):
+    """Fetches all games for a comma-separated list of systems."""
+    return list(iter_all_games_for_systems(systems_str))
+
+def get_change_token():
+    """Returns the current delta-sync token: the newest sequence number in the change log."""
+    with db_pool.connection() as conn:
+        if not conn:
+            raise sqlite3.OperationalError("Database not found.")
+        return conn.execute("SELECT MAX(seq) FROM game_changes").fetchone()[0] or 0
+
+def _iter_change_rows(since, token, system_list):
+    # Rows newer than the token just read are left for the next sync, so every reply is
+    # consistent with the token it hands out without holding a read transaction open.
+    rows = _iter_query("""
+        SELECT c.game_id, c.op, c.previous_systems, g.title, g.filepath, g.system
+        FROM game_changes c LEFT JOIN games g ON g.id = c.game_id
+        WHERE c.seq > ? AND c.seq <= ?
+        ORDER BY c.seq
+    """, (since, token), 'get_changes_since')
+    for row in rows:
+        in_scope = row['system'] is not None and (not system_list or row['system'] in system_list)
+        if row['op'] == 'upsert' and in_scope:
+            yield {'op': 'upsert', 'id': row['game_id'], 'title': row['title'],
+                   'filepath': row['filepath'], 'system': row['system']}
+        elif _was_in_scope(row['previous_systems'], system_list):
+            # Deleted, or moved out of the systems this device syncs
+            yield {'op': 'delete', 'id': row['game_id']}
+
+def _was_in_scope(previous_systems, system_list):
+    """Whether the device may hold a game that had `previous_systems` (None: not recorded, so assume it may)."""
+    if not system_list or previous_systems is None:
+        return True
+    return any(system in system_list for system in previous_systems.split(','))
+
+def _iter_snapshot_rows(system_list):
+    if system_list:
+        games = iter_all_games_for_systems(','.join(system_list))
+    else:
+        games = _iter_query("SELECT id, title, filepath, system FROM games ORDER BY system, title",
+                            (), 'get_changes_since')
+    for game in games:
+        yield {'op': 'upsert', **game}
+
+def iter_changes_since(token_str, systems_str=''):
+    """
+    Streams what changed in the library since a sync token, for GET_CHANGES_SINCE.
+    The first row is {"token": <new token>, "reset": <bool>}; the client keeps the token
+    for its next sync. The rest are {"op": "upsert", "id", "title", "filepath", "system"}
+    or {"op": "delete", "id"} rows in the order the changes happened.
+    An empty or unknown token gets a reset: every game as an upsert, after which the
+    client should drop any games it did not receive.
+    Raises sqlite3.OperationalError if the change log has not been created yet.
+    """
+    system_list = [s.strip() for s in systems_str.split(',')] if systems_str else []
+    token = get_change_token()
+    since = int(token_str) if token_str.strip().isdigit() else None
+
+    if since is None or since > token:
+        rows = _iter_snapshot_rows(system_list)
+        return itertools.chain([{'token': token, 'reset': True}], rows)
+    return itertools.chain([{'token': token, 'reset': False}], _iter_change_rows(since, token, system_list))
+
+def send_json_array(conn, rows):
+    """
+    Streams rows to a legacy client as one JSON array. The output is byte-for-byte what
+    json.dumps(list(rows)) would produce, but it is written in chunks as rows come off
+    the cursor instead of being built in memory first.
+    """
+    buffer = ['[']
+    size = 1
+    first = True
+    for row in rows:
+        item = json.dumps(row) if first else ', ' + json.dumps(row)
+        first = False
+        buffer.append(item)
+        size += len(item)
+        if size >= RESPONSE_CHUNK_SIZE:
+            conn.sendall(''.join(buffer).encode('utf-8'))
+            buffer, size = [], 0
+    buffer.append(']')
+    conn.sendall(''.join(buffer).encode('utf-8'))
+
+def send_frame(conn, payload):
+    """Writes one length-prefixed frame: a 4-byte big-endian length followed by the payload."""
+    conn.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+def _rows_or_error(rows):
+    """Passes rows through; a database error while reading them becomes a final error row."""
     try:
-        db_conn = get_db_connection()
-        if not db_conn:
-            conn.sendall(b'ERROR:Database connection failed.')
-            return
+        yield from rows
+    except sqlite3.Error:
+        yield {'error': 'The library could not be read completely. Try again.'}
+
+def send_ndjson_frames(conn, rows):
+    """
+    Streams rows to a framed-protocol client as NDJSON (one JSON object per line),
+    packed into frames of roughly RESPONSE_CHUNK_SIZE bytes. An empty frame ends the reply.
+    If reading the rows fails part-way, the reply ends with an {"error": ...} object
+    instead, so the client knows the listing is incomplete and the session can go on.
+    """
+    buffer = []
+    size = 0
+    for row in _rows_or_error(rows):
+        line = json.dumps(row) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= RESPONSE_CHUNK_SIZE:
+            send_frame(conn, ''.join(buffer).encode('utf-8'))
+            buffer, size = [], 0
+    if buffer:
+        send_frame(conn, ''.join(buffer).encode('utf-8'))
+    send_frame(conn, b'')
+
+def send_rows(conn, rows, protocol):
+    """
+    Sends a listing reply in whichever format the client spoke. Text sessions get the
+    JSON array followed by a newline so the client knows where the reply ends.
+    The JSON formats have no way to flag an error after the opening bracket, so a database
+    error part-way through propagates and the connection is dropped without the closing
+    bracket or newline; the client sees a broken reply rather than a short one.
+    """
+    if protocol == PROTOCOL_FRAMED:
+        send_ndjson_frames(conn, rows)
+    else:
+        send_json_array(conn, rows)
+        if protocol == PROTOCOL_SESSION:
+            conn.sendall(b'\n')
+
+def send_error_line(conn, message):
+    """Sends a newline-terminated ERROR reply, the same shape as the SIZE header it replaces."""
+    conn.sendall(f'ERROR:{message}\n'.encode('utf-8'))
 
+def send_error(conn, message, protocol):
+    """Sends an ERROR reply to a listing command. Framed clients get it as a single NDJSON error object."""
+    if protocol == PROTOCOL_FRAMED:
+        send_ndjson_frames(conn, [{'error': message}])
+    else:
+        send_error_line(conn, message)
+
+def _recv_exact(conn, count):
+    """Reads exactly `count` bytes from the socket, or raises ConnectionError if the client goes away."""
+    data = bytearray()
+    while len(data) < count:
+        chunk = conn.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("Client closed the connection mid-request.")
+        data += chunk
+    return bytes(data)
+
+def read_frame(conn):
+    """Reads one length-prefixed request frame. Returns None if the client closed the connection instead."""
+    first = conn.recv(1)
+    if not first:
+        return None
+    (length,) = FRAME_HEADER.unpack(first + _recv_exact(conn, FRAME_HEADER.size - 1))
+    if length > MAX_REQUEST_SIZE:
+        raise ValueError(f"Request frame of {length} bytes exceeds the {MAX_REQUEST_SIZE} byte limit.")
+    return _recv_exact(conn, length).decode('utf-8').strip()
+
+class LineReader:
+    """Reads newline-terminated commands from a socket, keeping any pipelined bytes for the next call."""
+    def __init__(self, conn, buffered=b''):
+        self.conn = conn
+        self.buffer = buffered
+
+    def readline(self):
+        """Returns the next line without its newline, or None once the client has closed the connection."""
+        while b'\n' not in self.buffer:
+            if len(self.buffer) > MAX_REQUEST_SIZE:
+                raise ValueError(f"Request line exceeds the {MAX_REQUEST_SIZE} byte limit.")
+            chunk = self.conn.recv(MAX_REQUEST_SIZE)
+            if not chunk:
+                line, self.buffer = self.buffer, b''
+                return line or None
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line
+
+def read_request(conn):
+    """
+    Reads the first command from a new connection and reports which protocol the client speaks.
+    Framed clients send a 4-byte big-endian length and then the UTF-8 command; since
+    commands are far shorter than 16 MiB the first byte is always NUL, which never starts
+    a legacy command. Legacy clients send the bare command text in a single write.
+    Returns (request, framed, leftover) where leftover holds any bytes a legacy client
+    pipelined after the first line.
+    """
+    first = conn.recv(1, socket.MSG_PEEK)
+    if not first:
+        return '', False, b''
+
+    if first == b'\x00':
+        return read_frame(conn) or '', True, b''
+
+    data = conn.recv(MAX_REQUEST_SIZE)
+    # Old clients give no terminator, so a long command (e.g. a big system list) that
+    # spans several TCP segments is picked up by waiting briefly for the rest of it.
+    # Short commands arrive in one segment and never pay this wait.
+    while LEGACY_SPLIT_THRESHOLD <= len(data) < MAX_REQUEST_SIZE and b'\n' not in data:
+        ready, _, _ = select.select([conn], [], [], LEGACY_READ_GRACE)
+        if not ready:
+            break
+        more = conn.recv(MAX_REQUEST_SIZE - len(data))
+        if not more:
+            break
+        data += more
+    line, _, leftover = data.partition(b'\n')
+    return line.decode('utf-8').strip(), False, leftover
+
+def _send_buffered(conn, f, offset, count, chunk_size=TRANSFER_CHUNK_SIZE):
+    """Copies a file region to the socket through a reusable userspace buffer."""
+    f.seek(offset)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    remaining = count
+    while remaining > 0:
+        read = f.readinto(view[:min(chunk_size, remaining)])
+        if not read:
+            break
+        conn.sendall(view[:read])
+        remaining -= read
+    return count - remaining
+
+def stream_file(conn, f, offset, count, use_sendfile=None):
+    """
+    Sends `count` bytes of the open binary file `f`, starting at `offset`, to the socket.
+    Uses kernel zero-copy (os.sendfile via socket.sendfile) where the platform has it,
+    otherwise falls back to a large buffered copy. Returns the number of bytes sent.
+    """
+    if use_sendfile is None:
+        use_sendfile = Config.PC_SERVER_USE_SENDFILE
+    if use_sendfile and hasattr(os, 'sendfile'):
+        try:
+            return conn.sendfile(f, offset, count)
+        except (AttributeError, NotImplementedError):
+            # e.g. a TLS-wrapped or otherwise unsupported socket type
+            pass
+    return _send_buffered(conn, f, offset, count)
+
+def _lookup_rom_path(conn, game_id, allow_dir=False):
+    """
+    Resolves a game's ROM file from the database.
+    Replies with an ERROR and returns None when the game or its file is unavailable.
+    Games stored as folders (extracted ZIPs, multi-track disc sets) are only returned
+    when allow_dir is set; the single-file commands point the client at DOWNLOAD_BUNDLE.
+    """
+    with db_pool.connection() as db_conn:
+        if not db_conn:
+            send_error_line(conn, 'Database connection failed.')
+            return None
         game = db_conn.execute("SELECT filepath FROM games WHERE id = ?", (game_id,)).fetchone()
-        db_conn.close()
 
-        if not game or not game['filepath']:
-            conn.sendall(b'ERROR:Game not found in database.')
-            return
+    if not game or not game['filepath']:
+        send_error_line(conn, 'Game not found in database.')
+        return None
 
-        # --- CORRECTED PATH LOGIC ---
-        # The database now stores the full, absolute path. We use it directly.
-        full_rom_path = game['filepath']
-        
-        print("\n--- DOWNLOAD DEBUG ---")
-        print(f"  Path from Database: {full_rom_path}")
-        
-        if not os.path.exists(full_rom_path):
-            print(f"  File Check: FAILED. File does not exist at this path.")
-            print("----------------------\n")
-            conn.sendall(b'ERROR:ROM file not found on server disk.')
-            return
-        
-        print(f"  File Check: SUCCESS. File found.")
+    # --- CORRECTED PATH LOGIC ---
+    # The database now stores the full, absolute path. We use it directly.
+    full_rom_path = game['filepath']
+    
+    print("\n--- DOWNLOAD DEBUG ---")
+    print(f"  Path from Database: {full_rom_path}")
+    
+    if not os.path.exists(full_rom_path):
+        print(f"  File Check: FAILED. File does not exist at this path.")
         print("----------------------\n")
-        
-        rom_path = Path(full_rom_path)
+        send_error_line(conn, 'ROM file not found on server disk.')
+        return None
+    
+    print(f"  File Check: SUCCESS. File found.")
+    print("----------------------\n")
+
+    if os.path.isdir(full_rom_path) and not allow_dir:
+        send_error_line(conn, 'This game is a folder of files. Use DOWNLOAD_BUNDLE to download it.')
+        return None
+    return Path(full_rom_path)
+
+_hash_cache = {}
+_hash_cache_lock = threading.Lock()
+
+def file_sha256(path):
+    """Returns the SHA-256 hex digest of a file, cached by path, size and modification time."""
+    stat = os.stat(path)
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_cache_lock:
+        digest = _hash_cache.get(key)
+    if digest:
+        return digest
+
+    sha = hashlib.sha256()
+    buffer = bytearray(TRANSFER_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        while read := f.readinto(buffer):
+            sha.update(view[:read])
+    digest = sha.hexdigest()
+    _remember_sha256(key, digest)
+    return digest
+
+def _remember_sha256(key, digest):
+    with _hash_cache_lock:
+        # Forget digests of older versions of the same file
+        for stale_key in [k for k in _hash_cache if k[0] == key[0]]:
+            del _hash_cache[stale_key]
+        _hash_cache[key] = digest
+
+def send_game_file(conn, game_id):
+    """Finds a game by ID, uses its absolute path, and sends the file."""
+    header_sent = False
+    try:
+        rom_path = _lookup_rom_path(conn, game_id)
+        if not rom_path:
+            return
+
         file_size = rom_path.stat().st_size
         print(f"Sending file: {rom_path.name}, Size: {file_size} bytes")
 
         header = f"SIZE:{file_size}\n".encode('utf-8')
         conn.sendall(header)
+        header_sent = True
 
         with open(rom_path, 'rb') as f:
-            while chunk := f.read(4096):
-                conn.sendall(chunk)
+            stream_file(conn, f, 0, file_size)
         print("File sending complete.")
 
     except Exception as e:
         print(f"Error during file send for game ID {game_id}: {e}")
+        if header_sent:
+            # The client is counting raw bytes now, so an ERROR line would be read as
+            # ROM data. Dropping the connection is the only unambiguous signal.
+            raise
         try:
-            conn.sendall(f'ERROR:{str(e)}'.encode('utf-8'))
+            send_error_line(conn, str(e))
         except:
             pass
 
+def send_game_range(conn, game_id, offset, length=None):
+    """
+    Sends part of a game's ROM so an interrupted download can be resumed.
+    The header reports the slice and the whole file's SHA-256 so the client can
+    verify the reassembled file:
+        SIZE:<length>;OFFSET:<offset>;TOTAL:<file size>;SHA256:<hex digest>\n
+    A zero-length request returns just the header, which lets a client fetch the hash
+    of a file it downloaded with plain DOWNLOAD_GAME.
+    """
+    try:
+        rom_path = _lookup_rom_path(conn, game_id)
+    except Exception as e:
+        print(f"Error during range send for game ID {game_id}: {e}")
+        send_error_line(conn, str(e))
+        return
+    if rom_path:
+        send_file_range(conn, rom_path, offset, length)
+
+def send_file_range(conn, path, offset, length=None):
+    """Sends a slice of one file with the SIZE;OFFSET;TOTAL;SHA256 header used by DOWNLOAD_GAME_RANGE."""
+    header_sent = False
+    try:
+        file_size = path.stat().st_size
+        if offset > file_size:
+            send_error_line(conn, f'Offset {offset} is beyond the end of the file ({file_size} bytes).')
+            return
+        available = file_size - offset
+        length = available if length is None else min(length, available)
+
+        digest = file_sha256(path)
+        print(f"Sending range of {path.name}: offset {offset}, {length} of {file_size} bytes")
+
+        header = f"SIZE:{length};OFFSET:{offset};TOTAL:{file_size};SHA256:{digest}\n".encode('utf-8')
+        conn.sendall(header)
+        header_sent = True
+
+        if length:
+            with open(path, 'rb') as f:
+                stream_file(conn, f, offset, length)
+        print("Range sending complete.")
+
+    except Exception as e:
+        print(f"Error during range send for {path}: {e}")
+        if header_sent:
+            # The client is counting raw bytes now, so an ERROR line would be read as
+            # ROM data. Dropping the connection is the only unambiguous signal.
+            raise
+        try:
+            send_error_line(conn, str(e))
+        except:
+            pass
+
+# --- Bundle downloads (folder games) ---
+def list_bundle_files(game_path):
+    """
+    Lists the files that make up a game as (relative POSIX path, absolute Path) pairs,
+    in a stable sorted order so file indexes mean the same thing across connections.
+    A single-file game is a bundle of one. Symlinks leading outside the game folder are skipped.
+    """
+    if game_path.is_file():
+        return [(game_path.name, game_path)]
+
+    root = game_path.resolve()
+    files = []
+    for dirpath, dirnames, filenames in os.walk(game_path):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = Path(dirpath) / name
+            if not path.is_file() or root not in path.resolve().parents:
+                continue
+            files.append((path.relative_to(game_path).as_posix(), path))
+    return files
+
+def _bundle_manifest_line(game_path, files):
+    entries = [{'path': rel_path, 'size': path.stat().st_size} for rel_path, path in files]
+    manifest = {'name': game_path.name, 'total': sum(e['size'] for e in entries), 'files': entries}
+    return f"MANIFEST:{json.dumps(manifest)}\n".encode('utf-8'), entries
+
+def send_game_bundle(conn, game_id, manifest_only=False):
+    """
+    Sends every file of a game in one reply: a manifest line
+        MANIFEST:{"name": ..., "total": <bytes>, "files": [{"path": ..., "size": ...}, ...]}\n
+    followed by the contents of each file back to back, in manifest order.
+    With manifest_only (GET_BUNDLE_MANIFEST) only the manifest line is sent, so a client
+    can fetch the files itself in parallel over several connections with DOWNLOAD_BUNDLE_FILE.
+    """
+    header_sent = False
+    try:
+        game_path = _lookup_rom_path(conn, game_id, allow_dir=True)
+        if not game_path:
+            return
+
+        files = list_bundle_files(game_path)
+        manifest_line, entries = _bundle_manifest_line(game_path, files)
+        conn.sendall(manifest_line)
+        header_sent = True
+        if manifest_only:
+            return
+
+        print(f"Sending bundle {game_path.name}: {len(files)} files")
+        for (rel_path, path), entry in zip(files, entries):
+            with open(path, 'rb') as f:
+                sent = stream_file(conn, f, 0, entry['size'])
+            if sent != entry['size']:
+                raise IOError(f"{rel_path} changed size during the transfer")
+        print("Bundle sending complete.")
+
+    except Exception as e:
+        print(f"Error during bundle send for game ID {game_id}: {e}")
+        if header_sent:
+            raise
+        try:
+            send_error_line(conn, str(e))
+        except:
+            pass
+
+def send_bundle_file(conn, game_id, index, offset, length=None):
+    """Sends one file of a bundle by its manifest index, with the same header as DOWNLOAD_GAME_RANGE."""
+    try:
+        game_path = _lookup_rom_path(conn, game_id, allow_dir=True)
+        if not game_path:
+            return
+        files = list_bundle_files(game_path)
+    except Exception as e:
+        print(f"Error during bundle file send for game ID {game_id}: {e}")
+        send_error_line(conn, str(e))
+        return
+    if not 0 <= index < len(files):
+        send_error_line(conn, f'File index {index} is out of range; the bundle has {len(files)} files.')
+        return
+    send_file_range(conn, files[index][1], offset, length)
+
+# --- Compressed transfers ---
+def _zlib_compressor():
+    return zlib.compressobj(6)
+
+def _zstd_compressor():
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+# Codecs a client may ask for, keyed by wire name: (cache file suffix, compressor factory)
+COMPRESSION_CODECS = {'zlib': ('.zz', _zlib_compressor)}
+if zstandard:
+    COMPRESSION_CODECS['zstd'] = ('.zst', _zstd_compressor)
+
+_compression_locks = {}
+_compression_locks_guard = threading.Lock()
+
+def _compression_lock(cache_key):
+    """One lock per cached stream so concurrent downloads of a ROM compress it only once."""
+    with _compression_locks_guard:
+        return _compression_locks.setdefault(cache_key, threading.Lock())
+
+def _prune_transfer_cache(keep):
+    """Removes the least recently used cached streams until the cache fits PC_SERVER_CACHE_MAX_BYTES."""
+    cache_dir = Path(Config.PC_SERVER_CACHE_FOLDER)
+    entries = []
+    total = 0
+    for path in cache_dir.iterdir():
+        if path.suffix == '.json' or path.name.endswith('.tmp'):
+            continue
+        stat = path.stat()
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    for _, size, path in sorted(entries):
+        if total <= Config.PC_SERVER_CACHE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        path.unlink(missing_ok=True)
+        path.with_name(path.name + '.json').unlink(missing_ok=True)
+        total -= size
+
+def get_compressed_stream(rom_path, codec):
+    """
+    Returns (path_to_send, encoding, raw_size, sha256) for a ROM compressed with `codec`.
+    The compressed stream is built once per ROM version and kept in PC_SERVER_CACHE_FOLDER,
+    keyed by path, size and modification time. When compression does not make the file
+    smaller the raw ROM is sent instead, with encoding 'identity'.
+    """
+    stat = rom_path.stat()
+    suffix, make_compressor = COMPRESSION_CODECS[codec]
+    cache_key = hashlib.sha1(f"{rom_path}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+    cache_dir = Path(Config.PC_SERVER_CACHE_FOLDER)
+    cached_path = cache_dir / f"{cache_key}{suffix}"
+    meta_path = cache_dir / f"{cache_key}{suffix}.json"
+
+    with _compression_lock(cached_path.name):
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta['encoding'] == 'identity':
+                return rom_path, 'identity', stat.st_size, meta['sha256']
+            if cached_path.exists():
+                os.utime(cached_path)  # mark as recently used for the LRU prune
+                return cached_path, codec, stat.st_size, meta['sha256']
+
+        print(f"Compressing {rom_path.name} with {codec} for transfer cache...")
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = cached_path.with_name(cached_path.name + '.tmp')
+        sha = hashlib.sha256()
+        compressor = make_compressor()
+        with open(rom_path, 'rb') as src, open(temp_path, 'wb') as dst:
+            while chunk := src.read(TRANSFER_CHUNK_SIZE):
+                sha.update(chunk)
+                dst.write(compressor.compress(chunk))
+            dst.write(compressor.flush())
+        digest = sha.hexdigest()
+        _remember_sha256((str(rom_path), stat.st_size, stat.st_mtime_ns), digest)
+
+        if temp_path.stat().st_size >= stat.st_size:
+            temp_path.unlink()
+            meta_path.write_text(json.dumps({'encoding': 'identity', 'sha256': digest}))
+            print(f"{rom_path.name} does not compress; it will be sent raw.")
+            return rom_path, 'identity', stat.st_size, digest
+
+        os.replace(temp_path, cached_path)
+        meta_path.write_text(json.dumps({'encoding': codec, 'sha256': digest}))
+        print(f"Cached {rom_path.name}: {stat.st_size} -> {cached_path.stat().st_size} bytes.")
+        _prune_transfer_cache(keep=cached_path)
+        return cached_path, codec, stat.st_size, digest
+
+def send_game_compressed(conn, game_id, codecs, offset=0):
+    """
+    Sends a ROM using the first codec in the client's preference list that the server
+    supports (zlib always, zstd when the zstandard package is installed). The header is
+        SIZE:<bytes that follow>;OFFSET:<offset>;TOTAL:<stream size>;ENCODING:<codec>;RAW_SIZE:<n>;SHA256:<raw digest>\n
+    ENCODING is 'identity' when none of the codecs is available or the ROM does not
+    compress. OFFSET/TOTAL refer to the encoded stream, so a dropped compressed transfer
+    can be resumed the same way as DOWNLOAD_GAME_RANGE.
+    """
+    header_sent = False
+    try:
+        rom_path = _lookup_rom_path(conn, game_id)
+        if not rom_path:
+            return
+
+        codec = next((c for c in codecs if c in COMPRESSION_CODECS), None)
+        if codec:
+            send_path, encoding, raw_size, digest = get_compressed_stream(rom_path, codec)
+        else:
+            send_path, encoding = rom_path, 'identity'
+            raw_size, digest = rom_path.stat().st_size, file_sha256(rom_path)
+
+        total = send_path.stat().st_size
+        if offset > total:
+            send_error_line(conn, f'Offset {offset} is beyond the end of the stream ({total} bytes).')
+            return
+        length = total - offset
+        print(f"Sending {rom_path.name} ({encoding}): {length} of {total} bytes, {raw_size} raw")
+
+        header = (f"SIZE:{length};OFFSET:{offset};TOTAL:{total};ENCODING:{encoding};"
+                  f"RAW_SIZE:{raw_size};SHA256:{digest}\n").encode('utf-8')
+        conn.sendall(header)
+        header_sent = True
+
+        if length:
+            with open(send_path, 'rb') as f:
+                stream_file(conn, f, offset, length)
+        print("Compressed sending complete.")
+
+    except Exception as e:
+        print(f"Error during compressed send for game ID {game_id}: {e}")
+        if header_sent:
+            raise
+        try:
+            send_error_line(conn, str(e))
+        except:
+            pass
+
+def parse_compressed_request(args):
+    """Parses '<id>[:<codec,codec...>[:<offset>]]' into (game_id, codecs, offset). Raises ValueError on bad input."""
+    parts = args.split(':')
+    if len(parts) > 3:
+        raise ValueError("Expected DOWNLOAD_GAME_COMPRESSED:<id>[:<codecs>[:<offset>]]")
+    game_id = parts[0]
+    codecs = [c.strip().lower() for c in parts[1].split(',')] if len(parts) > 1 else ['zstd', 'zlib']
+    offset = int(parts[2]) if len(parts) == 3 and parts[2] != '' else 0
+    if offset < 0:
+        raise ValueError("Offset must not be negative")
+    return game_id, codecs, offset
+
+def parse_range_request(args):
+    """Parses '<id>:<offset>[:<length>]' into (game_id, offset, length). Raises ValueError on bad input."""
+    parts = args.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError("Expected DOWNLOAD_GAME_RANGE:<id>:<offset>[:<length>]")
+    game_id = parts[0]
+    offset = int(parts[1])
+    length = int(parts[2]) if len(parts) == 3 and parts[2] != '' else None
+    if offset < 0 or (length is not None and length < 0):
+        raise ValueError("Offset and length must not be negative")
+    return game_id, offset, length
+
+class ClientLimits:
+    """
+    Per-device bookkeeping for the concurrent server.
+    Caps how many connections and ROM transfers a single client address may hold
+    so one handheld cannot starve the others, and how many transfers run server-wide.
+    """
+    def __init__(self, max_connections_per_client, max_transfers, max_transfers_per_client):
+        self.max_connections_per_client = max_connections_per_client
+        self.max_transfers_per_client = max_transfers_per_client
+        self._transfer_slots = threading.BoundedSemaphore(max_transfers)
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._transfers = {}
+
+    def open_connection(self, client_ip):
+        with self._lock:
+            if self._connections.get(client_ip, 0) >= self.max_connections_per_client:
+                return False
+            self._connections[client_ip] = self._connections.get(client_ip, 0) + 1
+            return True
+
+    def close_connection(self, client_ip):
+        with self._lock:
+            remaining = self._connections.get(client_ip, 0) - 1
+            if remaining > 0:
+                self._connections[client_ip] = remaining
+            else:
+                self._connections.pop(client_ip, None)
+
+    def start_transfer(self, client_ip):
+        """Claims a transfer slot without blocking. Returns False when the server or client is at its limit."""
+        with self._lock:
+            if self._transfers.get(client_ip, 0) >= self.max_transfers_per_client:
+                return False
+            if not self._transfer_slots.acquire(blocking=False):
+                return False
+            self._transfers[client_ip] = self._transfers.get(client_ip, 0) + 1
+            return True
+
+    def finish_transfer(self, client_ip):
+        with self._lock:
+            remaining = self._transfers.get(client_ip, 0) - 1
+            if remaining > 0:
+                self._transfers[client_ip] = remaining
+            else:
+                self._transfers.pop(client_ip, None)
+            self._transfer_slots.release()
+
+def handle_request(conn, request, client_ip, limits, protocol=PROTOCOL_LEGACY):
+    """
+    Dispatches a single wire command and writes its reply to the client.
+    Listing replies are a JSON array for legacy clients (newline-terminated inside a
+    text session) and NDJSON frames for framed clients. Download replies (SIZE header +
+    raw bytes, or an ERROR line) are the same for every protocol.
+    """
+    if request == 'GET_SYSTEMS':
+        send_rows(conn, get_systems_data(), protocol)
+    elif request.startswith('GET_GAMES:'):
+        system_name = request.split(':', 1)[1]
+        send_rows(conn, iter_games_for_system(system_name), protocol)
+    elif request.startswith('GET_ALL_GAMES_FOR_SYSTEMS:'):
+        systems_str = request.split(':', 1)[1]
+        send_rows(conn, iter_all_games_for_systems(systems_str), protocol)
+    elif request.startswith('GET_CHANGES_SINCE:'):
+        token_str, _, systems_str = request.split(':', 1)[1].partition(':')
+        try:
+            changes = iter_changes_since(token_str, systems_str)
+        except sqlite3.OperationalError as e:
+            print(f"Delta sync unavailable: {e}")
+            send_error(conn, "Change tracking is not set up. Run the web app (run.py) once to update the database.", protocol)
+            return
+        send_rows(conn, changes, protocol)
+    elif request.startswith('DOWNLOAD_GAME:'):
+        game_id = request.split(':', 1)[1]
+        run_transfer(conn, client_ip, limits, send_game_file, game_id)
+    elif request.startswith('DOWNLOAD_GAME_RANGE:'):
+        try:
+            game_id, offset, length = parse_range_request(request.split(':', 1)[1])
+        except ValueError as e:
+            send_error_line(conn, str(e))
+            return
+        run_transfer(conn, client_ip, limits, send_game_range, game_id, offset, length)
+    elif request.startswith('GET_BUNDLE_MANIFEST:'):
+        game_id = request.split(':', 1)[1]
+        send_game_bundle(conn, game_id, manifest_only=True)
+    elif request.startswith('DOWNLOAD_BUNDLE:'):
+        game_id = request.split(':', 1)[1]
+        run_transfer(conn, client_ip, limits, send_game_bundle, game_id)
+    elif request.startswith('DOWNLOAD_BUNDLE_FILE:'):
+        try:
+            game_id, _, range_args = request.split(':', 1)[1].partition(':')
+            index_str, _, range_args = range_args.partition(':')
+            index = int(index_str)
+            _, offset, length = parse_range_request(f"{game_id}:{range_args or 0}")
+        except ValueError as e:
+            send_error_line(conn, str(e))
+            return
+        run_transfer(conn, client_ip, limits, send_bundle_file, game_id, index, offset, length)
+    elif request.startswith('DOWNLOAD_GAME_COMPRESSED:'):
+        try:
+            game_id, codecs, offset = parse_compressed_request(request.split(':', 1)[1])
+        except ValueError as e:
+            send_error_line(conn, str(e))
+            return
+        run_transfer(conn, client_ip, limits, send_game_compressed, game_id, codecs, offset)
+    elif protocol != PROTOCOL_LEGACY:
+        send_error(conn, f"Unknown command: {request}", protocol)
+
+def run_transfer(conn, client_ip, limits, send_func, *args):
+    """Runs a download inside one of the limited transfer slots."""
+    # Transfers never queue behind each other inside a worker: a busy server
+    # answers straight away so the worker is free again for listing commands.
+    if not limits.start_transfer(client_ip):
+        send_error_line(conn, 'Server busy, too many downloads in progress. Try again shortly.')
+        return
+    try:
+        send_func(conn, *args)
+    finally:
+        limits.finish_transfer(client_ip)
+
+class ClientConnection:
+    """
+    One accepted connection and what we know about it. `protocol` stays None until the
+    first command shows how the client talks; keep-alive connections then carry their
+    protocol and line reader from one command to the next.
+    """
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.client_ip = addr[0]
+        self.protocol = None
+        self.reader = None
+        self.idle_since = time.monotonic()
+
+    def read_command(self):
+        """Reads the next command of a keep-alive connection, or None once the client has closed it."""
+        if self.protocol == PROTOCOL_FRAMED:
+            return read_frame(self.conn)
+        line = self.reader.readline()
+        return None if line is None else line.decode('utf-8').strip()
+
+    def has_buffered_command(self):
+        """True if the client pipelined a complete command that is already read off the socket."""
+        return self.reader is not None and b'\n' in self.reader.buffer
+
+class ConnectionParking:
+    """
+    Holds connections that are waiting for their next command, so an idle keep-alive
+    session costs a selector entry rather than a worker thread. The accept loop owns the
+    selector; workers hand connections back through park(), which wakes it up.
+    """
+    def __init__(self, server_socket):
+        self.selector = selectors.DefaultSelector()
+        self._returned = queue.SimpleQueue()
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self.selector.register(server_socket, selectors.EVENT_READ)
+        self.selector.register(self._wake_recv, selectors.EVENT_READ)
+
+    def park(self, client):
+        """Called from a worker: waits for the client's next command off the worker pool."""
+        client.idle_since = time.monotonic()
+        self._returned.put(client)
+        try:
+            self._wake_send.send(b'\0')
+        except BlockingIOError:
+            pass  # a wake-up is already pending
+
+    def add(self, client):
+        """Called from the accept loop: starts watching a connection."""
+        self.selector.register(client.conn, selectors.EVENT_READ, client)
+
+    def ready(self, timeout):
+        """Waits for activity and returns the clients that have something to read, no longer watched."""
+        clients = []
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj is self._wake_recv:
+                try:
+                    while self._wake_recv.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                while not self._returned.empty():
+                    self.add(self._returned.get())
+            elif key.data is not None:
+                self.selector.unregister(key.fileobj)
+                clients.append(key.data)
+        return clients
+
+    def expire(self, limits):
+        """
+        Closes connections that sat idle too long: keep-alive sessions after
+        PC_SERVER_IDLE_TIMEOUT, new connections that never sent a command after PC_SERVER_CLIENT_TIMEOUT.
+        """
+        now = time.monotonic()
+        for key in list(self.selector.get_map().values()):
+            client = key.data
+            if client is None:
+                continue
+            timeout = Config.PC_SERVER_CLIENT_TIMEOUT if client.protocol is None else Config.PC_SERVER_IDLE_TIMEOUT
+            if now - client.idle_since >= timeout:
+                if client.protocol is None:
+                    print(f"Client {client.addr} timed out.")
+                else:
+                    print(f"Closing idle session from {client.client_ip}.")
+                self.selector.unregister(client.conn)
+                close_client(client, limits)
+
+    def close(self, limits):
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                close_client(key.data, limits)
+        self.selector.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+
+def close_client(client, limits):
+    try:
+        client.conn.close()
+    finally:
+        limits.close_connection(client.client_ip)
+
+def _first_command(client, limits):
+    """
+    Reads the first command of a new connection and works out its protocol.
+    Framed connections stay open for further frames until BYE. A legacy client can ask
+    for the same keep-alive behaviour by sending SESSION followed by newline-terminated
+    commands; the server acknowledges with OK:SESSION. Returns the command to run, or
+    None once a one-shot legacy command has been answered.
+    """
+    request, framed, leftover = read_request(client.conn)
+    if framed:
+        client.protocol = PROTOCOL_FRAMED
+        return request
+    if request == 'SESSION':
+        client.conn.sendall(b'OK:SESSION\n')
+        client.protocol = PROTOCOL_SESSION
+        client.reader = LineReader(client.conn, leftover)
+        return ''
+    # Anything else is answered once and the connection is closed, exactly as before
+    handle_request(client.conn, request, client.client_ip, limits)
+    return None
+
+def handle_client(client, limits, parking):
+    """
+    Serves a connection on a worker thread once it has something to read. Commands of a
+    keep-alive connection run strictly in order; pipelined commands wait in the socket
+    buffer until their turn. When nothing more is waiting, the connection is parked again
+    and the worker goes back to the pool, until the client sends BYE, closes the
+    connection or stays idle for PC_SERVER_IDLE_TIMEOUT seconds.
+    """
+    try:
+        if client.protocol is None:
+            request = _first_command(client, limits)
+        else:
+            request = client.read_command()
+        while request is not None and request != 'BYE':
+            if request:
+                handle_request(client.conn, request, client.client_ip, limits, client.protocol)
+            if not client.has_buffered_command():
+                parking.park(client)
+                return
+            request = client.read_command()
+    except socket.timeout:
+        print(f"Client {client.addr} timed out.")
+    except Exception as e:
+        print(f"Error handling client connection {client.addr}: {e}")
+    close_client(client, limits)
+
+# --- LAN discovery ---
+def get_local_ip(peer=None):
+    """
+    Returns this machine's LAN address without any outbound traffic.
+    Connecting a UDP socket sends nothing; it only asks the OS which local interface
+    routes to the peer (or to a private-range address when no peer is given). If there
+    is no route at all, e.g. the machine is offline, a non-loopback address of this host
+    is used, falling back to 127.0.0.1.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((peer or '10.255.255.255', 9))
+            return s.getsockname()[0]
+    except OSError:
+        pass
+    try:
+        addresses = socket.gethostbyname_ex(socket.gethostname())[2]
+        return next((a for a in addresses if not a.startswith('127.')), '127.0.0.1')
+    except OSError:
+        return '127.0.0.1'
+
+def get_server_info(peer=None):
+    """What a handheld needs to connect: where we are, what we speak and how current the library is."""
+    try:
+        revision = get_change_token()
+    except Exception:
+        revision = None  # change log not created yet
+    return {
+        'service': DISCOVERY_SERVICE,
+        'host': get_local_ip(peer),
+        'port': Config.PC_SERVER_PORT,
+        'protocol': PROTOCOL_VERSION,
+        'revision': revision,
+    }
+
+def run_discovery_responder(stop_event):
+    """
+    Answers LAN discovery broadcasts. A handheld sends the datagram PGS_DISCOVER to the
+    broadcast address on PC_SERVER_DISCOVERY_PORT and gets get_server_info() back as JSON.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind((Config.PC_SERVER_HOST, Config.PC_SERVER_DISCOVERY_PORT))
+        sock.settimeout(1.0)
+        while not stop_event.is_set():
+            try:
+                data, addr = sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                print(f"Discovery socket error: {e}")
+                continue
+            if data.strip() != DISCOVERY_REQUEST:
+                continue
+            try:
+                sock.sendto(json.dumps(get_server_info(addr[0])).encode('utf-8'), addr)
+            except OSError as e:
+                print(f"Could not answer discovery request from {addr}: {e}")
+
+def accept_clients(server_socket, parking, limits):
+    """Accepts every pending connection and starts watching it for its first command."""
+    while True:
+        try:
+            conn, addr = server_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        print(f"Connection from {addr}")
+        if not limits.open_connection(addr[0]):
+            print(f"Refusing connection from {addr}: too many open connections from this client.")
+            with conn:
+                try:
+                    conn.settimeout(Config.PC_SERVER_CLIENT_TIMEOUT)
+                    send_error_line(conn, 'Too many connections from this device.')
+                except OSError:
+                    pass
+            continue
+        # A stalled client (stopped reading mid-transfer, or never sends its
+        # command) is dropped after the timeout instead of pinning a worker.
+        conn.settimeout(Config.PC_SERVER_CLIENT_TIMEOUT)
+        parking.add(ClientConnection(conn, addr))
+
 def main():
-    """The main server loop with a non-blocking socket for graceful shutdown."""
-    host = '0.0.0.0'
-    port = 8081
+    """The main server loop. Connections are accepted here and served concurrently by a worker pool."""
+    host = Config.PC_SERVER_HOST
+    port = Config.PC_SERVER_PORT
     
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    limits = ClientLimits(Config.PC_SERVER_MAX_CONNECTIONS_PER_CLIENT,
+                          Config.PC_SERVER_MAX_TRANSFERS,
+                          Config.PC_SERVER_MAX_TRANSFERS_PER_CLIENT)
+    executor = ThreadPoolExecutor(max_workers=Config.PC_SERVER_MAX_WORKERS, thread_name_prefix='pc_server')
+    stop_discovery = threading.Event()
+    parking = None
     
     try:
         server_socket.bind((host, port))
-        server_socket.listen(5)
-        server_socket.settimeout(1.0) # Set a 1-second timeout
+        server_socket.listen(64)
+        server_socket.setblocking(False)
+        parking = ConnectionParking(server_socket)
         
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM); s.connect(("8.8.8.8", 80)); local_ip = s.getsockname()[0]; s.close()
+        local_ip = get_local_ip()
+        discovery_thread = threading.Thread(target=run_discovery_responder, args=(stop_discovery,),
+                                            name='pc_server-discovery', daemon=True)
+        discovery_thread.start()
         print("============================================================")
         print(f"SUCCESS! Anbernic server is listening on {local_ip}:{port}")
+        print(f"Serving up to {Config.PC_SERVER_MAX_WORKERS} commands and {Config.PC_SERVER_MAX_TRANSFERS} downloads at once.")
+        print(f"Answering LAN discovery on UDP port {Config.PC_SERVER_DISCOVERY_PORT}.")
         print("Press Ctrl+C to stop the server.")
         print("============================================================")
 
+        # Connections only reach a worker once they have a command to read; between
+        # commands they wait here, in the selector (woken at least once a second to expire idle ones).
         while True:
             try:
-                conn, addr = server_socket.accept()
-                print(f"Connection from {addr}")
-                with conn:
-                    request = conn.recv(1024).decode('utf-8').strip()
-                    
-                    if request == 'GET_SYSTEMS':
-                        data = get_systems_data()
-                        conn.sendall(json.dumps(data).encode('utf-8'))
-                    elif request.startswith('GET_GAMES:'):
-                        system_name = request.split(':', 1)[1]
-                        data = get_games_for_system(system_name)
-                        conn.sendall(json.dumps(data).encode('utf-8'))
-                    elif request.startswith('GET_ALL_GAMES_FOR_SYSTEMS:'):
-                        systems_str = request.split(':', 1)[1]
-                        data = get_all_games_for_systems(systems_str)
-                        conn.sendall(json.dumps(data).encode('utf-8'))
-                    elif request.startswith('DOWNLOAD_GAME:'):
-                        game_id = request.split(':', 1)[1]
-                        send_game_file(conn, game_id)
-
-            except socket.timeout:
-                continue # This is expected, just loop again
+                for client in parking.ready(timeout=1.0):
+                    executor.submit(handle_client, client, limits, parking)
+                parking.expire(limits)
+                accept_clients(server_socket, parking, limits)
             except Exception as e:
-                print(f"Error handling client connection: {e}")
+                print(f"Error accepting client connection: {e}")
     
     except KeyboardInterrupt:
         print("\nCtrl+C received. Shutting down server.")
     except Exception as e:
         print(f"A fatal server error occurred: {e}")
     finally:
+        stop_discovery.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if parking:
+            parking.close(limits)
         if server_socket:
             server_socket.close()
             print("Server socket closed.")
@@ -0,0 +1,62 @@
+# precompress_static.py
+# Writes gzip (and brotli, when the `brotli` package is installed) copies of the emulator
+# cores and other large static scripts next to the originals. The /assets route serves
+# these instead of the raw file to clients that accept the encoding.
+#
+# Usage: python precompress_static.py [--force]
+#
+# Run it again after adding or updating cores; copies older than their source are ignored
+# by the server, so a stale build never serves outdated bytes.
+
+import argparse
+import gzip
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_FOLDER = Path(__file__).resolve().parent / 'static'
+# Files worth compressing: the cores and the scripts loaded on the emulator page
+PATTERNS = ['js/cores/*.wasm', 'js/cores/*.js', 'js/*.js', 'css/*.css']
+MIN_SIZE = 1024
+
+def _compressors():
+    compressors = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    return compressors
+
+def precompress(force=False):
+    compressors = _compressors()
+    written = 0
+    for pattern in PATTERNS:
+        for source in sorted(STATIC_FOLDER.glob(pattern)):
+            if source.stat().st_size < MIN_SIZE:
+                continue
+            data = None
+            for suffix, compress in compressors:
+                target = source.with_name(source.name + suffix)
+                if not force and target.exists() and target.stat().st_mtime_ns >= source.stat().st_mtime_ns:
+                    continue
+                data = data if data is not None else source.read_bytes()
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    target.unlink(missing_ok=True)
+                    continue
+                target.write_bytes(compressed)
+                written += 1
+                print(f"{source.relative_to(STATIC_FOLDER)}{suffix}: {len(data)} -> {len(compressed)} bytes")
+    if brotli is None:
+        print("brotli is not installed; only gzip copies were written.")
+    print(f"Wrote {written} precompressed file(s).")
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompress emulator cores and static scripts.')
+    parser.add_argument('--force', action='store_true', help='rebuild copies even if they are up to date')
+    args = parser.parse_args()
+    precompress(force=args.force)
+
+if __name__ == '__main__':
+    main()
@@ -41,6 +41,12 @@ EXTENSION_TO_SYSTEM = {
     '.exe': 'PC', # Generic for PC games, if you want to manage those
 }
 
+# ROM extensions the in-browser (libretro/Nostalgist) cores can load directly.
+WEB_SUPPORTED_EXTENSIONS = {
+    '.nes', '.sfc', '.smc', '.gb', '.gbc', '.gba',
+    '.gen', '.md', '.sms', '.gg', '.bin'
+}
+
 # --- Emulator Configurations ---
 # Dictionary of recommended emulators with their download URLs and supported systems.
 EMULATORS = {
@@ -23,15 +23,14 @@ except ImportError:
 
 from .config import DATABASE_PATH, UPLOAD_FOLDER, COVERS_FOLDER, EMULATORS_FOLDER, EXTENSION_TO_SYSTEM, EMULATORS, Config
 from utils import get_effective_path, get_setting
+import db
 
 # --- Database Functions ---
 def get_db_connection():
     """Establishes a connection to the SQLite database."""
     if not os.path.exists(DATABASE_PATH):
         raise FileNotFoundError(f"Database not found at '{DATABASE_PATH}'.\nPlease run the main web app (run.py) once to create it.")
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.get_connection(str(DATABASE_PATH))
 
 def update_game_metadata_in_db(game_id, changes):
     """Updates a game's metadata in the database."""
@@ -9,8 +9,10 @@ import shutil
 import requests
 import subprocess
 from pathlib import Path
+from collections import OrderedDict
 import time
 import sys
+import threading
 
 # --- UNIFIED CONFIGURATION IMPORT ---
 # This block intelligently loads settings from both the main web app config and the scanner's config.
@@ -26,11 +28,16 @@ try:
     BASE_DIR = basedir
     print(f"Successfully imported top-level config. Database path is: {DATABASE_PATH}")
 
-    from ..config import EMULATORS_FOLDER, EXTENSION_TO_SYSTEM, EMULATORS, SETTINGS_FILE
+    from ..config import EMULATORS_FOLDER, EXTENSION_TO_SYSTEM, EMULATORS, SETTINGS_FILE, WEB_SUPPORTED_EXTENSIONS
     
 except ImportError as e:
     print(f"Failed to import unified config, falling back to scanner-only config: {e}")
-    from ..config import DATABASE_PATH, UPLOAD_FOLDER, EMULATORS_FOLDER, EXTENSION_TO_SYSTEM, EMULATORS, SETTINGS_FILE, BASE_DIR, COVERS_FOLDER
+    from ..config import DATABASE_PATH, UPLOAD_FOLDER, EMULATORS_FOLDER, EXTENSION_TO_SYSTEM, EMULATORS, SETTINGS_FILE, BASE_DIR, COVERS_FOLDER, WEB_SUPPORTED_EXTENSIONS
+
+import db
+import migrations
+import facets
+from migrations import ROM_INDEX_COLUMNS, SEARCH_COLUMNS
 
 try:
     import py7zr
@@ -61,41 +68,272 @@ def fetch_igdb_data(game_title, system_name, log_callback, client_id, client_sec
     # This function is not used by the web app in its current state
     pass
 
+_migrated = set()
+_migrate_lock = threading.Lock()
+
 def get_db_connection():
-    db_path_obj = Path(DATABASE_PATH)
-    db_path_obj.parent.mkdir(parents=True, exist_ok=True)
-    db_just_created = not db_path_obj.exists()
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    if db_just_created:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS games (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, system TEXT NOT NULL,
-                filepath TEXT NOT NULL UNIQUE, original_filename TEXT, genre TEXT,
-                release_year INTEGER, developer TEXT, publisher TEXT, description TEXT,
-                play_status TEXT DEFAULT 'Not Played', cover_image_path TEXT
-            )''')
-        conn.execute('CREATE TABLE IF NOT EXISTS systems (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE)')
-        conn.execute('CREATE TABLE IF NOT EXISTS emulator_configs (emulator_name TEXT PRIMARY KEY, emulator_path TEXT, install_type TEXT)')
-        conn.commit()
-    else:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(games)")
-        columns = [column[1] for column in cursor.fetchall()]
-        if 'cover_image_path' not in columns:
-            cursor.execute("ALTER TABLE games ADD COLUMN cover_image_path TEXT")
-        conn.commit()
+    """
+    This thread's shared connection to the library (see db.py). The schema is migrated
+    (see migrations.py) the first time each database is opened in the process, not on every call.
+    """
+    Path(DATABASE_PATH).parent.mkdir(parents=True, exist_ok=True)
+    conn = db.get_connection(DATABASE_PATH)
+    key = os.path.abspath(DATABASE_PATH)
+    if key not in _migrated:
+        with _migrate_lock:
+            if key not in _migrated:
+                migrations.migrate(conn)
+                _migrated.add(key)
     return conn
 
-def get_all_games_from_db(system_name=None):
+# --- Library listing ---
+# Only what a library card shows; description and the other metadata stay on disk
+LIBRARY_CARD_COLUMNS = "id, title, system, cover_image_path, is_web_playable"
+LIBRARY_PAGE_SIZE = 60
+
+# --- Full-text search (games_fts, see migrations.py) ---
+# bm25 weights, in SEARCH_COLUMNS order: a title hit outranks one in the description
+SEARCH_WEIGHTS = [10.0, 2.0, 3.0, 3.0, 2.0, 1.0]
+SEARCH_RESULT_COLUMNS = LIBRARY_CARD_COLUMNS + ", developer, publisher, genre, release_year"
+
+def _fts_query(text):
+    """Turns free text into an FTS5 query: every word must match, each as a prefix."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_games(query, system_name=None, web_playable_only=False, limit=50):
+    """
+    Ranked full-text search over title, system, developer, publisher, genre and description.
+    Words match as prefixes and must all be present ("zel oca" finds Ocarina of Time).
+    Returns a list of dicts with SEARCH_RESULT_COLUMNS, best match first; limit=None returns all.
+    """
+    match = _fts_query(query or "")
+    if not match:
+        return []
     conn = get_db_connection()
+    conditions, params = [], []
     if system_name:
-        games = conn.execute("SELECT * FROM games WHERE system = ? ORDER BY title", (system_name,)).fetchall()
+        conditions.append("g.system = ?")
+        params.append(system_name)
+    if web_playable_only:
+        conditions.append("g.is_web_playable = 1")
+    columns = ", ".join(f"g.{col.strip()}" for col in SEARCH_RESULT_COLUMNS.split(","))
+    try:
+        where = "".join(f" AND {condition}" for condition in conditions)
+        weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+        rows = conn.execute(f"SELECT {columns} FROM games_fts JOIN games g ON g.id = games_fts.rowid "
+                            f"WHERE games_fts MATCH ?{where} ORDER BY bm25(games_fts, {weights}), g.title LIMIT ?",
+                            [match] + params + [limit if limit is not None else -1]).fetchall()
+    except sqlite3.OperationalError:
+        # No FTS5 in this SQLite build: every word as a substring of any searched column
+        for word in re.findall(r"\w+", query):
+            conditions.append("(" + " OR ".join(f"g.{col} LIKE ?" for col in SEARCH_COLUMNS) + ")")
+            params.extend([f"%{word}%"] * len(SEARCH_COLUMNS))
+        rows = conn.execute(f"SELECT {columns} FROM games g WHERE {' AND '.join(conditions)} ORDER BY g.title LIMIT ?",
+                            params + [limit if limit is not None else -1]).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+# --- Web ROM resolution index ---
+# Which file the web emulator serves for a game is worked out once (at import, or when the
+# files change) and stored on the game row (ROM_INDEX_COLUMNS), so serving a ROM is a single lookup.
+# rom_source_mtime is NULL for games never resolved, and ROM_SOURCE_MISSING for games whose
+# path did not exist when they were, so a start-up refresh does not look for them again.
+ROM_SOURCE_MISSING = 0
+
+def find_zip_rom_member(zip_path):
+    """Returns the name of the first web-supported ROM inside a ZIP archive, or None."""
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            return next((info.filename for info in sorted(zf.infolist(), key=lambda i: i.filename)
+                         if not info.is_dir() and os.path.splitext(info.filename)[1].lower() in WEB_SUPPORTED_EXTENSIONS), None)
+    except (zipfile.BadZipFile, OSError):
+        return None
+
+def resolve_web_rom(filepath):
+    """
+    Works out which file the web emulator should load for a game's stored path.
+    Directory games are searched for the first supported ROM, then for a ZIP holding one.
+    For ZIPs, web_rom_path is the archive and web_rom_member the ROM inside it. Returns a
+    dict with the ROM_INDEX_COLUMNS values; web_rom_path is None when nothing servable exists.
+    """
+    entry = {'web_rom_path': None, 'web_rom_name': None, 'is_web_playable': 0,
+             'web_rom_size': None, 'web_rom_mtime': None, 'rom_source_mtime': None,
+             'web_rom_member': None}
+    try:
+        source_stat = os.stat(filepath)
+    except (OSError, TypeError):
+        entry['rom_source_mtime'] = ROM_SOURCE_MISSING
+        return entry
+    entry['rom_source_mtime'] = source_stat.st_mtime_ns
+
+    rom_path = member = None
+    if os.path.isdir(filepath):
+        zip_paths = []
+        for root, dirs, files in os.walk(filepath):
+            dirs.sort()
+            rom_path = next((os.path.join(root, f) for f in sorted(files)
+                             if os.path.splitext(f)[1].lower() in WEB_SUPPORTED_EXTENSIONS), None)
+            if rom_path:
+                break
+            zip_paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.zip'))
+        if not rom_path:
+            rom_path, member = next(((z, m) for z in zip_paths if (m := find_zip_rom_member(z))), (None, None))
+            if not rom_path:
+                return entry
+        rom_stat = os.stat(rom_path)
+        entry['is_web_playable'] = 1
     else:
-        games = conn.execute("SELECT * FROM games ORDER BY title").fetchall()
+        # Unsupported files are still recorded so callers can report them
+        rom_path, rom_stat = filepath, source_stat
+        if filepath.lower().endswith('.zip'):
+            member = find_zip_rom_member(filepath)
+            entry['is_web_playable'] = int(member is not None)
+        else:
+            entry['is_web_playable'] = int(os.path.splitext(filepath)[1].lower() in WEB_SUPPORTED_EXTENSIONS)
+
+    entry.update(web_rom_path=rom_path, web_rom_name=os.path.basename(member or rom_path),
+                 web_rom_size=rom_stat.st_size, web_rom_mtime=rom_stat.st_mtime_ns,
+                 web_rom_member=member)
+    return entry
+
+def rom_index_is_current(game):
+    """Cheap validity check for a stored resolution: one or two stat() calls, no directory walk."""
+    if game['rom_source_mtime'] is None:
+        return False
+    if game['rom_source_mtime'] == ROM_SOURCE_MISSING:
+        # Still current for as long as the path stays missing
+        return not os.path.exists(game['filepath'])
+    try:
+        if os.stat(game['filepath']).st_mtime_ns != game['rom_source_mtime']:
+            return False
+        if game['web_rom_path'] and game['web_rom_path'] != game['filepath']:
+            rom_stat = os.stat(game['web_rom_path'])
+            return rom_stat.st_size == game['web_rom_size'] and rom_stat.st_mtime_ns == game['web_rom_mtime']
+        return True
+    except OSError:
+        return False
+
+def update_rom_index(conn, game_id, filepath):
+    """Resolves a game's web ROM and stores it on the game row. The caller commits."""
+    entry = resolve_web_rom(filepath)
+    set_clause = ", ".join(f"{col} = ?" for col, _ in ROM_INDEX_COLUMNS)
+    conn.execute(f"UPDATE games SET {set_clause} WHERE id = ?",
+                 tuple(entry[col] for col, _ in ROM_INDEX_COLUMNS) + (game_id,))
+    return entry
+
+def get_rom_index_entry(conn, game):
+    """
+    Returns the web ROM resolution for a game row, re-resolving and saving it only if
+    the game's files changed on disk since it was stored.
+    """
+    if rom_index_is_current(game):
+        return {col: game[col] for col, _ in ROM_INDEX_COLUMNS}
+    entry = update_rom_index(conn, game['id'], game['filepath'])
+    conn.commit()
+    return entry
+
+def refresh_rom_index(conn, force=False, missing_only=False):
+    """
+    Re-resolves stored web ROM entries: those whose files changed on disk, every game with
+    force=True, or only games never resolved with missing_only=True. Games whose path was
+    missing are marked ROM_SOURCE_MISSING, so missing_only does not retry them; they are
+    re-resolved when next served or by a full refresh. Commits and returns (games_checked, games_updated).
+    """
+    query = "SELECT * FROM games WHERE rom_source_mtime IS NULL" if missing_only else "SELECT * FROM games"
+    checked = updated = 0
+    for game in conn.execute(query).fetchall():
+        checked += 1
+        if force or missing_only or not rom_index_is_current(game):
+            update_rom_index(conn, game['id'], game['filepath'])
+            updated += 1
+    conn.commit()
+    return checked, updated
+
+def get_all_games_from_db(system_name=None, web_playable_only=False):
+    conn = get_db_connection()
+    conditions, params = [], []
+    if system_name:
+        conditions.append("system = ?")
+        params.append(system_name)
+    if web_playable_only:
+        conditions.append("is_web_playable = 1")
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    games = conn.execute(f"SELECT * FROM games{where} ORDER BY title", params).fetchall()
     conn.close()
     return [dict(game) for game in games]
 
+def get_games_page(system_name=None, web_playable_only=False, after=None, limit=LIBRARY_PAGE_SIZE, filters=None):
+    """
+    Fetches one page of library cards ordered by (title, id), starting after the `after`
+    (title, id) key. Seeking by key instead of OFFSET keeps every page as cheap as the first.
+    `filters` narrows by genre, developer, publisher or release_year (see facets.py).
+    Returns (games, next_key); next_key is None on the last page.
+    """
+    conn = get_db_connection()
+    conditions, params = facets.facet_conditions(filters)
+    if system_name:
+        conditions.append("games.system = ?")
+        params.append(system_name)
+    if web_playable_only:
+        conditions.append("games.is_web_playable = 1")
+    if after:
+        conditions.append("(title, id) > (?, ?)")
+        params.extend(after)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = conn.execute(f"SELECT {LIBRARY_CARD_COLUMNS} FROM games{where} ORDER BY title, id LIMIT ?",
+                        params + [limit + 1]).fetchall()
+    conn.close()
+    games = [dict(row) for row in rows[:limit]]
+    next_key = (games[-1]['title'], games[-1]['id']) if len(rows) > limit else None
+    return games, next_key
+
+# Facet counts take a pass over every matching game and the library asks for them on each
+# page, so they are kept per filter set until the database changes. Changes are noticed
+# through PRAGMA data_version on a connection of our own: it only moves when another
+# connection commits, and this one never writes, so every commit shows up.
+FACET_COUNTS_CACHE_SIZE = 64
+_facet_counts_cache = OrderedDict()
+_facet_watch_connections = {}
+_facet_counts_lock = threading.Lock()
+
+def _library_data_version():
+    """A number that changes whenever anything commits to the library database. Caller holds _facet_counts_lock."""
+    key = os.path.abspath(DATABASE_PATH)
+    conn = _facet_watch_connections.get(key)
+    if conn is None:
+        conn = _facet_watch_connections[key] = db.connect(DATABASE_PATH, check_same_thread=False)
+    return key, conn.execute("PRAGMA data_version").fetchone()[0]
+
+def get_facet_counts(system_name=None, web_playable_only=False, filters=None):
+    """Per-value game counts for the library's filter sidebar (see facets.facet_counts)."""
+    filters = dict(filters or {})
+    if system_name:
+        filters['system'] = system_name
+    conn = get_db_connection()
+    try:
+        with _facet_counts_lock:
+            path, version = _library_data_version()
+            cache_key = (path, tuple(sorted((k, str(v)) for k, v in filters.items())), web_playable_only)
+            cached = _facet_counts_cache.get(cache_key)
+            if cached and cached[0] == version:
+                _facet_counts_cache.move_to_end(cache_key)
+                counts = cached[1]
+            else:
+                counts = None
+        if counts is None:
+            counts = facets.facet_counts(conn, filters, web_playable_only=web_playable_only)
+            with _facet_counts_lock:
+                _facet_counts_cache[cache_key] = (version, counts)
+                _facet_counts_cache.move_to_end(cache_key)
+                while len(_facet_counts_cache) > FACET_COUNTS_CACHE_SIZE:
+                    _facet_counts_cache.popitem(last=False)
+    finally:
+        conn.close()
+    # Callers decorate the entries (see the library sidebar), so hand out copies
+    return {field: [dict(item) for item in values] for field, values in counts.items()}
+
 def update_game_metadata_in_db(game_id, changes):
     conn = get_db_connection()
     set_clause = ", ".join([f"{key} = ?" for key in changes.keys()])
@@ -221,8 +459,9 @@ def import_games(games_to_import, import_mode, log_callback):
                 else: shutil.move(original_filepath, destination_path)
                 final_filepath = str(destination_path)
             
-            conn.execute("INSERT INTO games (title, system, filepath, original_filename, genre, release_year, developer, publisher, description, play_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            cursor = conn.execute("INSERT INTO games (title, system, filepath, original_filename, genre, release_year, developer, publisher, description, play_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
                           (title, system, final_filepath, original_filename, game.get('genre'), game.get('release_year'), game.get('developer'), game.get('publisher'), game.get('description'), game.get('play_status')))
+            update_rom_index(conn, cursor.lastrowid, final_filepath)
             conn.commit()
             yield {'filepath': original_filepath, 'success': True}
         except sqlite3.IntegrityError:
@@ -311,11 +550,26 @@ def download_and_setup_emulator(emu_config, progress_callback, log_callback):
         progress_callback(emu_config['name'], "Config Failed")
         raise e
 
+def _copy_database(src_conn, dest_conn):
+    """
+    Copies a whole database with SQLite's online backup API. Unlike copying the file, this
+    includes commits still sitting in the -wal file, and writing into a live database goes
+    through SQLite's locking, so connections open elsewhere (web app, pc_server) simply see
+    the new contents rather than a file replaced underneath them.
+    """
+    try:
+        src_conn.backup(dest_conn)
+    finally:
+        src_conn.close()
+        dest_conn.close()
+
 def backup_application_data(backup_location, log_callback, base_dir):
     backup_path = Path(backup_location)
     backup_path.mkdir(parents=True, exist_ok=True)
-    files_to_backup = [("Database", DATABASE_PATH), ("GUI Settings", SETTINGS_FILE)]
+    files_to_backup = [("GUI Settings", SETTINGS_FILE)]
     folders_to_backup = [("Uploaded Games", UPLOAD_FOLDER), ("Downloaded Emulators", EMULATORS_FOLDER)]
+    if Path(DATABASE_PATH).exists():
+        _copy_database(db.connect(DATABASE_PATH), sqlite3.connect(backup_path / Path(DATABASE_PATH).name))
     for _, src_path_str in files_to_backup:
         if Path(src_path_str).exists(): shutil.copy2(src_path_str, backup_path / Path(src_path_str).name)
     for _, src_path_str in folders_to_backup:
@@ -329,8 +583,20 @@ def backup_application_data(backup_location, log_callback, base_dir):
 def restore_application_data(restore_location, log_callback, base_dir):
     source_path = Path(restore_location)
     if not source_path.is_dir(): raise FileNotFoundError(f"Restore location '{restore_location}' not found.")
-    files_to_restore = [("Database", DATABASE_PATH), ("GUI Settings", SETTINGS_FILE)]
+    files_to_restore = [("GUI Settings", SETTINGS_FILE)]
     folders_to_restore = [("Uploaded Games", UPLOAD_FOLDER), ("Downloaded Emulators", EMULATORS_FOLDER)]
+    src_db = source_path / Path(DATABASE_PATH).name
+    if src_db.exists():
+        # Written into the live database rather than copied over its file, so it is safe
+        # with the web app or pc_server running and no stale -wal/-shm is left behind
+        Path(DATABASE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _copy_database(sqlite3.connect(src_db), db.connect(DATABASE_PATH))
+        # The backup may predate newer migrations
+        conn = db.connect(DATABASE_PATH)
+        try:
+            migrations.migrate(conn)
+        finally:
+            conn.close()
     for _, dest_path_str in files_to_restore:
         src_file = source_path / Path(dest_path_str).name
         if src_file.exists(): shutil.copy2(src_file, dest_path_str)
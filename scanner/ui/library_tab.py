@@ -14,7 +14,10 @@ try:
 except ImportError:
     PIL_AVAILABLE = False
 
-from ..core import get_all_games_from_db, update_game_metadata_in_db, delete_games_from_db, set_game_cover_image, fetch_igdb_data, download_and_set_cover_image
+from ..core import get_all_games_from_db, search_games, update_game_metadata_in_db, delete_games_from_db, set_game_cover_image, fetch_igdb_data, download_and_set_cover_image
+
+# Pause in typing (ms) before the search box queries the database
+SEARCH_DEBOUNCE_MS = 250
 
 def create_library_tab(notebook, app):
     """Creates the UI for the Library Management tab."""
@@ -32,7 +35,8 @@ def create_library_tab(notebook, app):
     app.library_search_var = tk.StringVar()
     search_entry = ttk.Entry(controls_frame, textvariable=app.library_search_var, width=30)
     search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
-    search_entry.bind("<KeyRelease>", lambda e: filter_library_view(app))
+    app.library_filter_job = None
+    search_entry.bind("<KeyRelease>", lambda e: schedule_library_filter(app))
 
     scan_all_button = ttk.Button(controls_frame, text="Scan All Metadata", command=lambda: scan_all_metadata(app))
     scan_all_button.pack(side=tk.LEFT, padx=5)
@@ -186,13 +190,27 @@ def _do_delete(app, game_ids):
     except Exception as e:
         app.log(f"Error deleting games: {e}", "error")
 
+def schedule_library_filter(app):
+    """Filters the library once typing pauses, rather than querying on every keystroke."""
+    if app.library_filter_job:
+        app.master.after_cancel(app.library_filter_job)
+    app.library_filter_job = app.master.after(SEARCH_DEBOUNCE_MS, lambda: filter_library_view(app))
+
 def filter_library_view(app):
-    search_term = app.library_search_var.get().lower()
+    app.library_filter_job = None
+    search_term = app.library_search_var.get().strip()
     for item in app.library_tree.get_children(): app.library_tree.delete(item)
-    for game in app.full_library_data:
-        if search_term in game.get('title', '').lower() or search_term in game.get('system', '').lower():
-            iid = f"game_{game['id']}"
-            app.library_tree.insert('', 'end', iid=iid, values=(game.get('title', ''), game.get('system', ''), game.get('genre', ''), game.get('release_year', ''), game.get('play_status', 'Not Played')))
+    if search_term:
+        # Ranked full-text search in the database; rows come from the loaded library data.
+        # Words match the start of words in any searched column ("mar" finds "Super Mario"),
+        # not anywhere inside the title as this box used to ("ario" no longer does).
+        games_by_id = {game['id']: game for game in app.full_library_data}
+        games = [games_by_id[result['id']] for result in search_games(search_term, limit=None) if result['id'] in games_by_id]
+    else:
+        games = app.full_library_data
+    for game in games:
+        iid = f"game_{game['id']}"
+        app.library_tree.insert('', 'end', iid=iid, values=(game.get('title', ''), game.get('system', ''), game.get('genre', ''), game.get('release_year', ''), game.get('play_status', 'Not Played')))
 
 def load_cover_image(app, image_path, max_size=(200, 200)):
     if not image_path or not os.path.exists(image_path):
@@ -19,7 +19,7 @@ try {
     throw new Error("Corrupted game data.");
 }
 
-const { rom_url: romUrl, title: gameTitle, emulator_core: emulatorCore, emulator_aspect_ratio: emulatorAspectRatioStr } = gameDetails;
+const { rom_url: romUrl, title: gameTitle, emulator_core: emulatorCore, core_urls: coreUrls, save_state_url: saveStateUrl, emulator_aspect_ratio: emulatorAspectRatioStr } = gameDetails;
 let nostalgist = null;
 
 // Parse the aspect ratio string into a numerical value (e.g., "4/3" becomes 1.333)
@@ -53,8 +53,9 @@ async function initializeEmulator() {
             element: document.getElementById('snes-canvas'),
             core: {
                 name: emulatorCore,
-                js: `/static/js/cores/${emulatorCore}_libretro.js`,
-                wasm: `/static/js/cores/${emulatorCore}_libretro.wasm`,
+                // Fingerprinted URLs from the server are cached by the browser indefinitely
+                js: coreUrls?.js || `/static/js/cores/${emulatorCore}_libretro.js`,
+                wasm: coreUrls?.wasm || `/static/js/cores/${emulatorCore}_libretro.wasm`,
             },
             rom: romUrl,
             audio: true,
@@ -75,7 +76,7 @@ async function initializeEmulator() {
         updateStatus('Emulator initialized. Loading ROM...');
         
         // Make nostalgist instance available to other modules
-        initializeUI(nostalgist, initializeEmulator, aspectRatio);
+        initializeUI(nostalgist, initializeEmulator, aspectRatio, saveStateUrl);
         initializeInput(nostalgist);
         initializeGamepad(nostalgist);
 
@@ -96,7 +97,7 @@ function gameLoop() {
 // --- Initial Setup ---
 window.addEventListener('load', () => {
     // --- FIX: Pass the calculated aspect ratio to the UI module on initial load ---
-    initializeUI(null, initializeEmulator, aspectRatio); 
+    initializeUI(null, initializeEmulator, aspectRatio, saveStateUrl); 
     initializeInput(null);
 
     // Attach the main click listener to start everything
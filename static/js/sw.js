@@ -0,0 +1,176 @@
+// static/js/sw.js
+// Service worker that keeps emulator cores and ROMs in the browser so a game that has
+// been played once starts without downloading anything from the server.
+//
+//   /assets/...    fingerprinted, immutable files (cores, nostalgist.js): cache first
+//   /roms/web/...  ROMs: served from cache, then revalidated in the background with the
+//                  server's ETag so a replaced ROM is picked up on the next launch
+//   /emulation/saves/...  save states: network first, the cached copy only when offline
+//
+// Cached entries are bounded by MAX_CACHE_BYTES; the least recently used are evicted.
+// Sizes and last-use times live in IndexedDB because the Cache API does not track them.
+
+const CACHE_NAME = 'pergamespace-emulator-v1';
+const MAX_CACHE_BYTES = 512 * 1024 * 1024;
+const CACHE_FIRST_PREFIXES = ['/assets/'];
+const REVALIDATE_PREFIXES = ['/roms/web/'];
+const NETWORK_FIRST_PREFIXES = ['/emulation/saves/'];
+
+const DB_NAME = 'pergamespace-sw';
+const DB_STORE = 'entries';
+
+// --- LRU bookkeeping (IndexedDB: url -> { url, size, lastUsed }) ---
+
+function openDb() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(DB_NAME, 1);
+        request.onupgradeneeded = () => request.result.createObjectStore(DB_STORE, { keyPath: 'url' });
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function withStore(mode, callback) {
+    const db = await openDb();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(DB_STORE, mode);
+        const result = callback(tx.objectStore(DB_STORE));
+        tx.oncomplete = () => { db.close(); resolve(result && 'result' in result ? result.result : undefined); };
+        tx.onerror = () => { db.close(); reject(tx.error); };
+    });
+}
+
+function touchEntry(url, size) {
+    return withStore('readwrite', (store) => {
+        if (size === undefined) {
+            const lookup = store.get(url);
+            lookup.onsuccess = () => {
+                if (lookup.result) store.put({ ...lookup.result, lastUsed: Date.now() });
+            };
+            return null;
+        }
+        return store.put({ url, size, lastUsed: Date.now() });
+    });
+}
+
+async function evictToFit() {
+    const entries = await withStore('readonly', (store) => store.getAll());
+    let total = entries.reduce((sum, entry) => sum + entry.size, 0);
+    if (total <= MAX_CACHE_BYTES) return;
+
+    const cache = await caches.open(CACHE_NAME);
+    entries.sort((a, b) => a.lastUsed - b.lastUsed);
+    for (const entry of entries) {
+        if (total <= MAX_CACHE_BYTES) break;
+        await cache.delete(entry.url);
+        await withStore('readwrite', (store) => store.delete(entry.url));
+        total -= entry.size;
+    }
+}
+
+// --- Caching strategies ---
+
+async function storeResponse(request, response) {
+    if (!response.ok || response.status !== 200 || response.type !== 'basic') return;
+    // Take the size from Content-Length; only a response without one (e.g. chunked)
+    // is read a second time to measure it, so a ROM is not pulled into memory just for this.
+    const length = parseInt(response.headers.get('Content-Length'), 10);
+    const sizeCopy = Number.isNaN(length) ? response.clone() : null;
+    const cache = await caches.open(CACHE_NAME);
+    await cache.put(request.url, response);
+    await touchEntry(request.url, sizeCopy ? (await sizeCopy.blob()).size : length);
+    await evictToFit();
+}
+
+async function rangeFromCached(request, cached) {
+    // The Cache API only holds full responses; answer a byte range by slicing one
+    const match = /^bytes=(\d*)-(\d*)$/.exec(request.headers.get('Range') || '');
+    if (!match) return null;
+    const blob = await cached.blob();
+    let start = match[1] === '' ? Math.max(blob.size - Number(match[2]), 0) : Number(match[1]);
+    let end = match[1] !== '' && match[2] !== '' ? Math.min(Number(match[2]), blob.size - 1) : blob.size - 1;
+    if (start > end || start >= blob.size) return null;
+    return new Response(blob.slice(start, end + 1), {
+        status: 206,
+        headers: {
+            'Content-Type': cached.headers.get('Content-Type') || 'application/octet-stream',
+            'Content-Range': `bytes ${start}-${end}/${blob.size}`,
+            'Content-Length': String(end - start + 1),
+        },
+    });
+}
+
+async function fromCache(request) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request.url);
+    if (!cached) return null;
+    touchEntry(request.url).catch(() => {});
+    if (request.headers.has('Range')) return rangeFromCached(request, cached);
+    return cached;
+}
+
+async function fetchAndStore(request) {
+    if (request.headers.has('Range')) return fetch(request);
+    const response = await fetch(request);
+    storeResponse(request, response.clone()).catch((error) => console.warn('SW cache write failed:', error));
+    return response;
+}
+
+async function revalidate(request) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request.url);
+    const headers = {};
+    if (cached && cached.headers.get('ETag')) headers['If-None-Match'] = cached.headers.get('ETag');
+    const response = await fetch(request.url, { headers, credentials: 'same-origin' });
+    if (response.status === 200) await storeResponse(request, response);
+}
+
+async function cacheFirst(event, backgroundRevalidate) {
+    const { request } = event;
+    const cached = await fromCache(request).catch(() => null);
+    if (cached) {
+        if (backgroundRevalidate) {
+            event.waitUntil(revalidate(request).catch(() => {}));
+        }
+        return cached;
+    }
+    return fetchAndStore(request);
+}
+
+async function networkFirst(request) {
+    try {
+        return await fetchAndStore(request);
+    } catch (error) {
+        const cached = await fromCache(request).catch(() => null);
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+// --- Lifecycle ---
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        const names = await caches.keys();
+        await Promise.all(names.filter((name) => name.startsWith('pergamespace-') && name !== CACHE_NAME)
+            .map((name) => caches.delete(name)));
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener('fetch', (event) => {
+    const { request } = event;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (CACHE_FIRST_PREFIXES.some((prefix) => url.pathname.startsWith(prefix))) {
+        event.respondWith(cacheFirst(event, false));
+    } else if (REVALIDATE_PREFIXES.some((prefix) => url.pathname.startsWith(prefix))) {
+        event.respondWith(cacheFirst(event, true));
+    } else if (NETWORK_FIRST_PREFIXES.some((prefix) => url.pathname.startsWith(prefix))) {
+        event.respondWith(networkFirst(request));
+    }
+});
@@ -2,6 +2,7 @@
 
 let nostalgistInstance = null;
 let restartEmulatorCallback = null;
+let saveStateUrl = null; // Server-side slot for save states (/emulation/saves/<game_id>/state-1)
 let canvasAspectRatio = 4 / 3; // Default aspect ratio
 
 // --- DOM Element References ---
@@ -105,6 +106,10 @@ function setupEventListeners() {
             updateStatus('Saving state...');
             const { state } = await nostalgistInstance.saveState();
             savedState = state;
+            if (saveStateUrl) {
+                const response = await fetch(saveStateUrl, { method: 'PUT', body: state });
+                if (!response.ok) throw new Error(`server replied ${response.status}`);
+            }
             updateStatus('Game state saved successfully!');
         } catch (error) {
             updateStatus(`Error saving state: ${error.message}`, 'error');
@@ -112,6 +117,15 @@ function setupEventListeners() {
     });
 
     elements.loadStateButton?.addEventListener('click', async () => {
+        if (nostalgistInstance && !savedState && saveStateUrl) {
+            // Nothing saved this session; pick up the state stored on the server, if any
+            try {
+                const response = await fetch(saveStateUrl);
+                if (response.ok) savedState = await response.blob();
+            } catch (error) {
+                console.warn('Could not fetch server save state:', error);
+            }
+        }
         if (!nostalgistInstance || !savedState) {
             updateStatus(nostalgistInstance ? 'No saved state found.' : 'Emulator not loaded.', 'warning');
             return;
@@ -149,10 +163,13 @@ function setupEventListeners() {
 }
 
 // --- Initialization ---
-export function initializeUI(nostalgist, restartCallback, aspectRatio) {
+export function initializeUI(nostalgist, restartCallback, aspectRatio, stateUrl) {
     if (nostalgist) {
         nostalgistInstance = nostalgist;
     }
+    if (stateUrl) {
+        saveStateUrl = stateUrl;
+    }
     if (restartCallback) {
         restartEmulatorCallback = restartCallback;
     }
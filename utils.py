@@ -1,8 +1,11 @@
 import os
 import json
+import threading
+import time
 # Import the Config class directly instead of relying on the Flask app context
 from config import Config
-from flask import current_app # Import current_app for accessing app.config
+import db
+from flask import current_app, g # current_app for app.config, g for request-scoped caches
 
 def load_settings():
     """Helper function to load settings from the JSON file, handling empty or corrupt files."""
@@ -54,4 +57,58 @@ def get_effective_path(setting_key_for_custom_path, default_config_key):
     # Fallback to the default path from Config
     # We need current_app.config to get the default path defined in Config object
     # This function should only be called within a Flask application context.
-    return current_app.config.get(default_config_key)
\ No newline at end of file
+    return current_app.config.get(default_config_key)
+
+# --- Game record cache ---
+# The game page, the emulator page and the ROM request that follows all need the same
+# game row. It is fetched once (joined with its system) and reused for the rest of the
+# request via flask.g, and across requests for GAME_RECORD_CACHE_TTL seconds.
+_game_records = {}
+_game_records_lock = threading.Lock()
+
+def get_game_record(game_id):
+    """
+    Returns the game row plus its system's system_id, emulator_core and aspect_ratio as a
+    dict (those are None if the system is unknown), or None if there is no such game. Callers must not modify the returned dict.
+    """
+    request_cache = g.setdefault('game_records', {})
+    if game_id in request_cache:
+        return request_cache[game_id]
+
+    ttl = current_app.config.get('GAME_RECORD_CACHE_TTL', 0)
+    now = time.monotonic()
+    with _game_records_lock:
+        cached = _game_records.get(game_id)
+    if cached and cached[0] > now:
+        record = cached[1]
+    else:
+        conn = db.get_connection(current_app.config['DATABASE'])
+        try:
+            row = conn.execute('''
+                SELECT g.*, s.id AS system_id, s.emulator_core, s.aspect_ratio
+                FROM games g LEFT JOIN systems s ON g.system = s.name
+                WHERE g.id = ?
+            ''', (game_id,)).fetchone()
+        finally:
+            conn.close()
+        record = dict(row) if row else None
+        if record and ttl > 0:
+            with _game_records_lock:
+                _game_records[game_id] = (now + ttl, record)
+
+    request_cache[game_id] = record
+    return record
+
+def invalidate_game_record(game_id=None):
+    """Drops a cached game record (or all of them) after the game's row has been changed."""
+    with _game_records_lock:
+        if game_id is None:
+            _game_records.clear()
+        else:
+            _game_records.pop(game_id, None)
+    request_cache = g.get('game_records')
+    if request_cache is not None:
+        if game_id is None:
+            request_cache.clear()
+        else:
+            request_cache.pop(game_id, None)